@@ -0,0 +1,212 @@
+"""
+Poll cycle benchmark cases.
+
+Each stage of a poll cycle is measured on its own, from building the
+request URL to sending the driver values, plus the whole cycle
+(Controller.query_weather) for a range of forecast days and locations.
+The node server runs against the in-process polyinterface stand-in
+(tools/harness) and the local API stand-in (tools/fake_api.py), so
+nothing leaves the machine.
+
+Copyright (C) 2021 Robert Paauwe
+"""
+
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+sys.path.insert(0, os.path.join(ROOT, 'tools', 'harness'))
+sys.path.insert(1, os.path.join(ROOT, 'tools'))
+sys.path.insert(2, ROOT)
+
+import polyinterface
+import fake_api
+from nodes import api
+from nodes import climacell
+from nodes import climacell_daily
+from nodes import fields
+from nodes import uom
+
+PARAMS = {
+        'APIKey': 'bench',
+        'Latitude': '38.9',
+        'Longitude': '-121.4',
+        'Elevation': '100',
+        'Units': 'us',
+        }
+
+
+"""
+    The API stand-in and the node servers the cases run against.  The
+    stand-in's rate limit is set high enough that the scheduler never
+    holds a query back.
+"""
+class Environment:
+    def __init__(self):
+        self.workdir = tempfile.mkdtemp(prefix='climacell-bench-')
+        self.api_server = fake_api.make_server(fake_api.parse_args([
+            '--port', '0', '--limit-hour', '1000000000', '--limit-day', '1000000000']))
+        threading.Thread(target=self.api_server.serve_forever, name='FakeAPI', daemon=True).start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.api_server.server_address[1])
+        self.controllers = {}
+
+    # A started node server with its first query done, shared by the
+    # cases that use the same days and locations
+    def controller(self, days, locations=1):
+        if (days, locations) in self.controllers:
+            return self.controllers[(days, locations)]
+
+        params = dict(PARAMS)
+        params['API URL'] = self.base_url
+        params['Forecast Days'] = str(days)
+        params['Locations'] = ';'.join('L{}:{:.2f},{:.2f}'.format(i, 38.9 + i / 10, -121.4 - i / 10) for i in range(1, locations))
+
+        poly = polyinterface.Interface('climacell', {'customParams': params}, keep=0)
+        control = climacell.Controller(poly)
+        control.cache.path = os.path.join(self.workdir, 'cache_{}.json'.format(len(self.controllers)))
+        poly.inConfig(poly.config)
+        control.start()
+        control.fetcher.wait_idle(60)
+        self.controllers[(days, locations)] = control
+        return control
+
+    def close(self):
+        for control in self.controllers.values():
+            control.stop()
+        self.api_server.shutdown()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def all_fields(timestep):
+    return [field for (field, tier) in fields.REQUEST[timestep]]
+
+def request_url(env, days):
+    end_time = datetime.datetime.utcfromtimestamp(time.time()) + datetime.timedelta(days=days, minutes=1)
+    return api.timelines_request(38.9, -121.4, ['5m', '1d'], api.merge_fields(all_fields('5m'), all_fields('1d')), end_time, base_url=env.base_url)
+
+def headers():
+    return {'apikey': PARAMS['APIKey'], 'Content-Type': 'application/JSON'}
+
+
+# Build the request for a full realtime + daily query
+def url_case(env):
+    now = time.time()
+    def run():
+        (realtime, tiers) = fields.due_fields('5m', {}, now)
+        (daily, tiers) = fields.due_fields('1d', {}, now)
+        api.timelines_request(38.9, -121.4, ['5m', '1d'], api.merge_fields(realtime, daily), None, base_url=env.base_url)
+    return run
+
+# HTTP round trip to the stand-in
+def fetch_case(env, days):
+    client = api.Client()
+    url = request_url(env, days)
+    def run():
+        r = client.get(url, headers=headers())
+        r.content
+        r.close()
+    return run
+
+def decode_case(env, days):
+    body = api.Client().get(request_url(env, days), headers=headers()).content
+    def run():
+        json.loads(body)
+    return run
+
+"""
+    Map a realtime interval to the conditions drivers.  Two intervals are
+    published in turn so the values always change and get sent.
+"""
+def conditions_case(env):
+    control = env.controller(1)
+    s = control.sites[0]
+    values = [s.timelines['5m'][0]['values'], s.timelines['5m'][1]['values']]
+    count = [0]
+    def run():
+        count[0] += 1
+        control.publish_conditions(s, values[count[0] % 2])
+    return run
+
+# Convert one value for every driver that has a conversion
+def conversion_case(env):
+    drivers = [driver for (driver, function) in uom.FUNCTION_MAP.items() if function is not None]
+    def run():
+        for driver in drivers:
+            uom.conversion(driver, 'us', 12.5)
+    return run
+
+# update_driver through setDriver to the message sent to Polyglot
+def update_driver_case(env):
+    control = env.controller(1)
+    count = [0]
+    def run():
+        count[0] += 1
+        control.update_driver('CLITEMP', 10 + count[0] % 2, False, 1)
+    return run
+
+# ETo for the forecast days
+def et0_case(env, days):
+    control = env.controller(days)
+    s = control.sites[0]
+    intervals = s.timelines['1d'][:days]
+    def run():
+        climacell_daily.forecast_et0(intervals, s.latitude, s.elevation, 0.23)
+    return run
+
+# Publish every forecast day, including the ETo (DailyNode.update_forecast)
+def forecast_case(env, days):
+    control = env.controller(days)
+    s = control.sites[0]
+    intervals = s.timelines['1d']
+    def run():
+        control.force = True
+        control.publish_forecast(s, intervals)
+        control.force = False
+    return run
+
+# Publish forecast days that haven't changed (the usual poll)
+def forecast_unchanged_case(env, days):
+    control = env.controller(days)
+    s = control.sites[0]
+    intervals = s.timelines['1d']
+    def run():
+        control.publish_forecast(s, intervals)
+    return run
+
+# A whole poll cycle that queries realtime and forecast data
+def cycle_case(env, days, locations):
+    control = env.controller(days, locations)
+    def run():
+        control.query_weather(True, True)
+    return run
+
+
+"""
+    The (name, setup) of every case.  setup(env) returns the function to
+    time.
+"""
+def cases(days=(1, 3, 7, 15), locations=(1, 4)):
+    yield ('url', url_case)
+    for d in days:
+        yield ('fetch[days={}]'.format(d), lambda env, d=d: fetch_case(env, d))
+    for d in days:
+        yield ('decode[days={}]'.format(d), lambda env, d=d: decode_case(env, d))
+    yield ('conditions', conditions_case)
+    yield ('conversion', conversion_case)
+    yield ('update_driver', update_driver_case)
+    for d in days:
+        yield ('et0[days={}]'.format(d), lambda env, d=d: et0_case(env, d))
+    for d in days:
+        yield ('forecast[days={}]'.format(d), lambda env, d=d: forecast_case(env, d))
+    for d in days:
+        yield ('forecast_unchanged[days={}]'.format(d), lambda env, d=d: forecast_unchanged_case(env, d))
+    for l in locations:
+        for d in days:
+            yield ('cycle[days={},locations={}]'.format(d, l), lambda env, d=d, l=l: cycle_case(env, d, l))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Run the poll cycle benchmarks.
+
+Each case is timed the way timeit does it: the number of calls per
+repeat is picked so one repeat takes at least --min-time seconds, then
+the repeat is run --repeat times with garbage collection off.  The
+median time per call is what's compared.
+
+    python3 bench/run.py --json baseline.json
+    python3 bench/run.py --compare baseline.json
+    python3 bench/run.py --filter 'cycle|forecast' --days 1,15
+
+With --compare the exit status is 1 when any case is slower than the
+baseline by more than --threshold, so it can gate a deploy.
+
+Copyright (C) 2021 Robert Paauwe
+"""
+
+import argparse
+import gc
+import json
+import logging
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import cases
+
+
+def measure(function, repeat, min_time):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    times = []
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for r in range(repeat):
+            start = time.perf_counter()
+            for i in range(number):
+                function()
+            times.append((time.perf_counter() - start) / number)
+    finally:
+        if enabled:
+            gc.enable()
+
+    return {
+            'number': number,
+            'repeat': repeat,
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+            'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+            'times': times,
+            }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=cases.ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def format_time(seconds):
+    for (unit, scale) in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '{:8.2f} {:<2}'.format(seconds / scale, unit)
+    return '{:8.2f} ns'.format(seconds / 1e-9)
+
+"""
+    Compare the results to a baseline.  Returns the names of the cases
+    that got slower by more than threshold (a fraction).
+"""
+def compare(results, baseline, threshold):
+    regressions = []
+    for (name, result) in results.items():
+        base = baseline.get(name)
+        if base is None:
+            result['change'] = None
+            continue
+        change = result['median'] / base['median'] - 1
+        result['change'] = change
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+def print_result(name, result, threshold):
+    line = '{:<34} {}  min {}  +-{:5.1f}%'.format(name, format_time(result['median']),
+            format_time(result['min']), 100 * result['stdev'] / result['median'] if result['median'] else 0)
+    change = result.get('change', False)
+    if change is None:
+        line += '   (new)'
+    elif change is not False:
+        line += '   {:+6.1f}%'.format(100 * change)
+        if change > threshold:
+            line += '  SLOWER'
+        elif change < -threshold:
+            line += '  faster'
+    print(line)
+
+def parse_list(value):
+    return tuple(int(v) for v in value.split(','))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the stages of a poll cycle')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.1, help='seconds per repeat, at least')
+    parser.add_argument('--days', type=parse_list, default=(1, 3, 7, 15), help='forecast days, comma separated')
+    parser.add_argument('--locations', type=parse_list, default=(1, 4), help='locations, comma separated')
+    parser.add_argument('--filter', help='only run the cases matching this regular expression')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='compare to the results in this file')
+    parser.add_argument('--threshold', type=float, default=0.15, help='slow down that counts as a regression (0.15 is 15%%)')
+    parser.add_argument('--log-level', default='ERROR')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    env = cases.Environment()
+    results = {}
+    try:
+        for (name, setup) in cases.cases(args.days, args.locations):
+            if args.filter and not re.search(args.filter, name):
+                continue
+            results[name] = measure(setup(env), args.repeat, args.min_time)
+            if baseline is not None:
+                compare({name: results[name]}, baseline, args.threshold)
+            print_result(name, results[name], args.threshold)
+    finally:
+        env.close()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'meta': {
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    'revision': git_revision(),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'settings': {k: v for (k, v) in vars(args).items() if k not in ('json', 'compare')},
+                    },
+                'results': results,
+                }, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('{} case(s) slower than the baseline by more than {:.0f}%: {}'.format(
+                len(regressions), 100 * args.threshold, ', '.join(regressions)))
+            return 1
+        print('No regressions against ' + args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
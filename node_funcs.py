@@ -6,6 +6,7 @@ try:
     import polyinterface
 except ImportError:
     import pgc_interface as polyinterface
+import time
 
 
 LOGGER = polyinterface.LOGGER
@@ -26,17 +27,99 @@ def add_functions_as_methods(functions):
     return decorator
 
 
+"""
+    Driver change deadbands.  A new value is only sent to Polyglot when it
+    differs from the last value sent by at least the absolute amount or
+    by the relative amount (fraction of the last value).  Drivers not
+    listed are sent on any change.  Nodes can override this by setting
+    their own 'deadbands' attribute.
+
+    Every driver is re-sent at least once per REFRESH_INTERVAL seconds so
+    the ISY can't drift out of sync with us.
+"""
+DEADBANDS = {
+        #           (absolute, relative)
+        'CLITEMP': (0.1, 0),      # temperature
+        'DEWPT':   (0.1, 0),      # dew point
+        'GV0':     (0.1, 0),      # high temp
+        'GV1':     (0.1, 0),      # low temp
+        'GV2':     (0.1, 0),      # feels like
+        'CLIHUM':  (1, 0),        # humidity
+        'GV14':    (1, 0),        # cloud cover
+        'GV18':    (1, 0),        # chance of precipitation
+        'BARPRES': (0, 0.0003),   # pressure
+        'SPEED':   (0.2, 0),      # wind speed
+        'GV5':     (0.2, 0),      # gust speed
+        'GV7':     (0.2, 0),      # wind speed max
+        'GV8':     (0.2, 0),      # wind speed min
+        'WINDDIR': (5, 0),        # wind direction
+        'DISTANC': (0, 0.02),     # visibility
+        'SOLRAD':  (5, 0),        # solar radiation
+        'RAINRT':  (0, 0.05),     # precipitation rate
+        'GV25':    (0.5, 0),      # solar elevation
+        }
+
+REFRESH_INTERVAL = 3600
+
+def changed_enough(deadband, old, new):
+    if deadband is None:
+        return new != old
+    (absolute, relative) = deadband
+    delta = abs(new - old)
+    if absolute == 0 and relative == 0:
+        return delta != 0
+    if absolute > 0 and delta >= absolute:
+        return True
+    if relative > 0 and delta > 0 and delta >= relative * abs(old):
+        return True
+    return False
+
 # Wrap all the setDriver calls so that we can check that the 
-# value exist first.
+# value exist first.  Values that haven't changed by more than the
+# driver's deadband since they were last sent are skipped.
 def update_driver(self, driver, value, force=False, prec=3):
     try:
         if value == None or value == "None":
             value = "0"
-        LOGGER.debug('setDriver (%s, %f)' %(driver, float(value)))
-        self.setDriver(driver, round(float(value), prec), True, force, self.uom[driver])
+        value = round(float(value), prec)
+
+        if not hasattr(self, 'last_sent'):
+            self.last_sent = {}
+
+        now = time.time()
+        if not force and driver in self.last_sent:
+            (last_value, last_time) = self.last_sent[driver]
+            if now - last_time >= REFRESH_INTERVAL:
+                force = True
+            else:
+                deadbands = getattr(self, 'deadbands', DEADBANDS)
+                if not changed_enough(deadbands.get(driver), last_value, value):
+                    count_update(self, 'driver_updates_skipped_total')
+                    return
+
+        LOGGER.debug('setDriver (%s, %f)' %(driver, value))
+        self.setDriver(driver, value, True, force, self.uom[driver])
+        self.last_sent[driver] = (value, now)
+        count_update(self, 'driver_updates_total')
     except:
         LOGGER.warning('Missing data for driver ' + driver)
 
+# Count driver updates in the controller's metrics (nodes/metrics.py)
+def count_update(self, name):
+    metrics = getattr(self.controller, 'metrics', None)
+    if metrics is not None:
+        metrics.inc(name)
+
+# Publish the values from an API interval using the node's compiled
+# field mapping (see nodes/fields.py).
+def update_mapped(self, values, force=False):
+    for (field, driver, convert, prec) in self.mapping:
+        if field in values:
+            value = values[field]
+            if convert is not None and value is not None:
+                value = convert(value)
+            self.update_driver(driver, value, force, prec)
+
 def get_saved_log_level(self):
     if 'customData' in self.polyConfig:
         if 'level' in self.polyConfig['customData']:
@@ -44,11 +127,23 @@ def get_saved_log_level(self):
 
     return 0
 
+# Polyglot replaces all of the custom data on a save so merge the new
+# entry with what's already there.
+def save_custom_data(self, key, value):
+    data = {}
+    try:
+        data.update(self.polyConfig['customData'])
+    except:
+        pass
+    data[key] = value
+    try:
+        self.polyConfig['customData'] = data
+    except:
+        pass
+    self.poly.saveCustomData(data)
+
 def save_log_level(self, level):
-    level_data = {
-            'level': level,
-            }
-    self.poly.saveCustomData(level_data)
+    self.save_custom_data('level', level)
 
 def set_logging_level(self, level=None):
     if level is None:
@@ -68,7 +163,7 @@ def set_logging_level(self, level=None):
     LOGGER.info('set_logging_level: Setting log level to %d' % level)
     LOGGER.setLevel(level)
 
-functions = (update_driver, get_saved_log_level, save_log_level, set_logging_level)
+functions = (update_driver, update_mapped, get_saved_log_level, save_custom_data, save_log_level, set_logging_level)
 
 """
     Functions to handle custom parameters.
@@ -79,6 +174,8 @@ functions = (update_driver, get_saved_log_level, save_log_level, set_logging_lev
          'default': default value of parameter,
          'notice': 'string to send notice if not set',
          'isRequired: True/False,
+         'type': int/float/str (optional, default is str),
+         'validator': function returning True if value is ok (optional),
         },
         {'name': name of parameter,
          'default': default value of parameter,
@@ -89,63 +186,106 @@ functions = (update_driver, get_saved_log_level, save_log_level, set_logging_lev
 
     usage:
        self.params = NSParameters(param_list)
-       self.params.get('param1')
+       self.params.get('param1')        # string value
+       self.params.value('param1')      # value converted to 'type'
        if self.params.isSet('param1'):
+       if 'param1' in self.params.changes():
 
+    Values are converted to their type once, when they are set, so the
+    typed value can be used freely in the poll loop.  A value that can't
+    be converted or fails validation is treated as not set: the typed
+    default is used (or None if the default isn't valid either) and a
+    required parameter gets its notice.
 """
 
 class NSParameters:
     def __init__(self, parameters):
-        self.internal = []
+        self.internal = {}
+        self.changed = set()
 
         for p in parameters:
-            self.internal.append({
+            param = {
                 'name': p['name'],
-                'value': '', 
+                'value': p['default'],
                 'default': p['default'],
                 'isSet': False,
                 'isRequired': p['isRequired'],
                 'notice_msg': p['notice'],
                 'isChanged': False,
-                })
+                'isValid': True,
+                'type': p.get('type', str),
+                'validator': p.get('validator', None),
+                'parsed': None,
+                'parsed_default': None,
+                }
+            (valid, param['parsed_default']) = self.parse(param, p['default'])
+            param['parsed'] = param['parsed_default']
+            self.internal[p['name']] = param
+
+    # Returns (valid, typed value), the typed default if it isn't valid
+    def parse(self, p, value):
+        try:
+            parsed = p['type'](value)
+            if p['validator'] is not None and not p['validator'](parsed):
+                raise ValueError('invalid value')
+            return (True, parsed)
+        except:
+            if value != p['default']:
+                LOGGER.error('Invalid value {} for {}'.format(value, p['name']))
+            return (False, p['parsed_default'])
+
+    def store(self, p, value):
+        p['value'] = value
+        (p['isValid'], p['parsed']) = self.parse(p, value)
 
     def set(self, name, value):
-        for p in self.internal:
-            if p['name'] == name:
-                if p['value'] != value:
-                    p['isChanged'] = True
-                else:
-                    p['isChanged'] = False
-                p['value'] = value
-                p['isSet'] = True
-                return
+        if name in self.internal:
+            p = self.internal[name]
+            if p['value'] != value:
+                p['isChanged'] = True
+                self.changed.add(name)
+            else:
+                p['isChanged'] = False
+            self.store(p, value)
+            p['isSet'] = p['isValid']
 
     def get(self, name):
-        for p in self.internal:
-            if p['name'] == name:
-                if p['isSet']:
-                    return p['value']
-                else:
-                    return p['default']
+        if name in self.internal:
+            p = self.internal[name]
+            if p['isSet']:
+                return p['value']
+            else:
+                return p['default']
+
+    # Return the value converted to the parameter's type
+    def value(self, name):
+        if name in self.internal:
+            p = self.internal[name]
+            if p['isSet']:
+                return p['parsed']
+            else:
+                return p['parsed_default']
 
     def isSet(self, name):
-        for p in self.internal:
-            if p['name'] == name:
-                return p['isSet']
+        if name in self.internal:
+            return self.internal[name]['isSet']
         return False
 
     def isChanged(self, name):
-        for p in self.internal:
-            if p['name'] == name:
-                return p['isChanged']
+        if name in self.internal:
+            return self.internal[name]['isChanged']
         return False
 
+    # The names of the parameters that changed in the last update
+    def changes(self):
+        return self.changed
+
     """
         Send notices for unconfigured parameters that are are marked
         as required.
     """
     def send_notices(self, poly):
-        for p in self.internal:
+        for p in self.internal.values():
             if not p['isSet'] and p['isRequired']:
                 if p['notice_msg'] is not None:
                     try:
@@ -162,8 +302,9 @@ class NSParameters:
     def get_from_polyglot(self, poly):
         customParams = poly.polyConfig['customParams']
         params = {}
+        self.changed = set()
 
-        for p in self.internal:
+        for p in self.internal.values():
             LOGGER.debug('checking for ' + p['name'] + ' in customParams')
             if p['name'] in customParams:
                 LOGGER.debug('found ' + p['name'] + ' in customParams')
@@ -171,23 +312,22 @@ class NSParameters:
 
                 if val != p['value']:
                     p['isChanged'] = True
+                    self.changed.add(p['name'])
                 else:
                     p['isChanged'] = False
 
-                p['value'] = val
+                self.store(p, val)
 
-                if p['value'] != p['default']:
+                if p['value'] != p['default'] and p['isValid']:
                     LOGGER.debug(p['name'] + ' is now set')
                     p['isSet'] = True
             
-            if p['isSet']:
-                params[p['name']] = p['value']
-            else:
-                params[p['name']] = p['default']
+            # an invalid value is left for the user to correct
+            params[p['name']] = p['value']
 
         poly.addCustomParam(params)            
 
-        for p in self.internal:
+        for p in self.internal.values():
             if not p['isSet'] and p['isRequired']:
                 return False
         return True
@@ -201,28 +341,28 @@ class NSParameters:
     def update_from_polyglot(self, config):
         changed = False
         valid = True
+        self.changed = set()
 
         if 'customParams' in config:
-            for p in self.internal:
+            for p in self.internal.values():
                 if p['name'] in config['customParams']:
                     poly_param = config['customParams'][p['name']]
 
-                    # did it change?
-                    if poly_param != p['default'] and poly_param != p['value']:
+                    # did it change? Going back to the default is a
+                    # change too.
+                    if poly_param != p['value']:
                         changed = True
                         p['isChanged'] = True
+                        self.changed.add(p['name'])
                     else:
                         p['isChanged'] = False
 
-                    # is it different from the default?
-                    if poly_param != p['default']:
-                        p['value'] = poly_param
-                        p['isSet'] = True
+                    self.store(p, poly_param)
+                    # is it different from the default and usable?
+                    p['isSet'] = poly_param != p['default'] and p['isValid']
 
-        for p in self.internal:
+        for p in self.internal.values():
             if not p['isSet'] and p['isRequired']:
                 valid = False
 
         return (valid, changed)
-
-
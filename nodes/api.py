@@ -0,0 +1,79 @@
+#
+#  HTTP client for the climacell API
+#
+#  A single requests session is owned by the controller and shared by
+#  every query so the pooled keep-alive connection (and its TLS session)
+#  to the API host is reused from poll to poll instead of paying a new
+#  DNS lookup, TCP connect and TLS handshake each time.
+
+import calendar
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = 5    # seconds to establish the connection
+READ_TIMEOUT = 30      # seconds to wait between bytes of the response
+POOL_SIZE = 4          # connections kept open per host
+
+
+class Client:
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, pool_size=POOL_SIZE):
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.session = None
+        self.open()
+
+    def open(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+            })
+
+    """
+        Issue a GET on the shared session. The caller is responsible
+        for reading and closing the response, which returns the
+        connection to the pool.
+    """
+    def get(self, url, headers=None):
+        if self.session is None:
+            self.open()
+        return self.session.get(url, headers=headers, timeout=self.timeout)
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+BASE_URL = 'https://data.climacell.co'
+
+"""
+    Build a v4 timelines request.  The timelines endpoint accepts more than
+    one timestep in a single call and returns a separate timeline for each,
+    so the realtime and daily data can be fetched together.
+"""
+def timelines_request(latitude, longitude, timesteps, fields, end_time=None, base_url=BASE_URL):
+    request = base_url + '/v4/timelines?'
+    request += 'location=' + str(latitude) + ',' + str(longitude)
+    request += '&timesteps=' + ','.join(timesteps)
+    if end_time is not None:
+        request += '&endTime=' + end_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+    request += '&fields=' + ','.join(fields)
+    return request
+
+# Merge field lists, keeping the order of first appearance
+def merge_fields(*field_lists):
+    fields = []
+    for field_list in field_lists:
+        for f in field_list:
+            if f not in fields:
+                fields.append(f)
+    return fields
+
+# Convert an API time stamp (2021-03-25T14:00:00Z) to epoch seconds
+def parse_time(timestamp):
+    return calendar.timegm(time.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ'))
@@ -0,0 +1,100 @@
+#
+#  Local astronomy
+#
+#  Sunrise, sunset, day length, solar elevation and moon phase calculated
+#  from the location instead of requested from the API.  The sun
+#  position uses the same FAO-56 declination and solar time terms as
+#  the ETo calculation (nodes/et3.py), which is good to a few minutes for
+#  sunrise and sunset.  The moon phase comes from the mean synodic month.
+#
+#  The daily values are cached per location and day so they are only
+#  calculated once a day.
+
+import calendar
+import math
+import time
+from functools import lru_cache
+from nodes import et3
+
+# Sunrise/sunset is when the top of the sun is on the horizon, corrected
+# for refraction.
+HORIZON = math.radians(-0.833)
+
+SYNODIC_MONTH = 29.530588853          # days
+NEW_MOON = 947182440                  # a new moon, 2000-01-06 18:14 UTC
+
+SUN_CACHE_SIZE = 64
+
+
+"""
+    Sunrise and sunset (epoch seconds) and the day length (hours) for a
+    location on a date.  When the sun doesn't rise or set that day the
+    times are None and the day length is 0 or 24.
+"""
+def sun_times(latitude, longitude, year, month, day):
+    return sun_times_cached(round(float(latitude), 3), round(float(longitude), 3), int(year), int(month), int(day))
+
+@lru_cache(maxsize=SUN_CACHE_SIZE)
+def sun_times_cached(latitude, longitude, year, month, day):
+    midnight = calendar.timegm((year, month, day, 0, 0, 0))
+    julian_day = time.gmtime(midnight).tm_yday
+
+    latitude_r = et3.deg2rad(latitude)
+    declination = et3.solar_declination(julian_day)
+
+    # solar noon in UTC hours, longitude is east positive
+    noon = 12 - longitude / 15 - et3.solar_time_correction(julian_day)
+
+    cos_omega = (math.sin(HORIZON) - math.sin(latitude_r) * math.sin(declination)) / (math.cos(latitude_r) * math.cos(declination))
+    if cos_omega >= 1:
+        return (None, None, 0.0)     # polar night
+    if cos_omega <= -1:
+        return (None, None, 24.0)    # midnight sun
+
+    half_day = math.degrees(math.acos(cos_omega)) / 15
+    sunrise = midnight + (noon - half_day) * 3600
+    sunset = midnight + (noon + half_day) * 3600
+    return (int(sunrise), int(sunset), 2 * half_day)
+
+def clear_sun_cache():
+    sun_times_cached.cache_clear()
+
+# Angle (degrees) of the sun above the horizon at time t (epoch seconds)
+def solar_elevation(latitude, longitude, t):
+    now = time.gmtime(t)
+    hours = now.tm_hour + now.tm_min / 60 + now.tm_sec / 3600
+
+    latitude_r = et3.deg2rad(latitude)
+    declination = et3.solar_declination(now.tm_yday)
+    omega = math.pi / 12 * (hours + longitude / 15 + et3.solar_time_correction(now.tm_yday) - 12)
+
+    sin_elevation = math.sin(latitude_r) * math.sin(declination) + math.cos(latitude_r) * math.cos(declination) * math.cos(omega)
+    return math.degrees(math.asin(max(-1.0, min(1.0, sin_elevation))))
+
+# Days since the last new moon at time t
+def moon_age(t):
+    return ((t - NEW_MOON) / 86400) % SYNODIC_MONTH
+
+"""
+    Moon phase at time t as 0 - 7: new, waxing crescent, first quarter,
+    waxing gibbous, full, waning gibbous, third quarter, waning crescent
+    (the MOON editor's values).
+"""
+def moon_phase(t):
+    return int(moon_age(t) / SYNODIC_MONTH * 8 + 0.5) % 8
+
+# Local time of day, in hours, for an epoch time
+def local_hours(t):
+    local = time.localtime(t)
+    return local.tm_hour + local.tm_min / 60
+
+
+if __name__ == "__main__":
+    # Greenwich, 2021-06-21: sunrise 03:43 UTC, sunset 20:21 UTC
+    (sunrise, sunset, length) = sun_times(51.4769, 0.0, 2021, 6, 21)
+    print('sunrise = ', time.strftime('%H:%M', time.gmtime(sunrise)))
+    print('sunset = ', time.strftime('%H:%M', time.gmtime(sunset)))
+    print('day length = ', length)
+    print('noon elevation = ', solar_elevation(51.4769, 0.0, calendar.timegm((2021, 6, 21, 12, 2, 0))))
+    # full moon 2021-06-24 18:40 UTC
+    print('moon phase = ', moon_phase(calendar.timegm((2021, 6, 24, 18, 40, 0))))
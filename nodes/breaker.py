@@ -0,0 +1,80 @@
+#
+#  Circuit breaker for the API
+#
+#  After a few queries in a row fail (no connection, time out, error
+#  response) the breaker opens and queries stop.  While it's open a
+#  single probe query is let through at growing intervals and the first
+#  one that succeeds closes the breaker again.  Meanwhile the node server
+#  keeps publishing the data it already has and reports how old it is.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import threading
+import time
+
+LOGGER = polyinterface.LOGGER
+
+FAILURE_THRESHOLD = 3    # failures in a row that open the breaker
+PROBE_MIN = 120          # seconds until the first probe
+PROBE_MAX = 3600         # longest time between probes
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.open = False
+        self.probe_interval = PROBE_MIN
+        self.next_probe = 0
+        self.probing = None      # probe schedule before the current probe
+
+    def is_open(self):
+        return self.open
+
+    """
+        Can a query be made now?  While the breaker is open only one
+        query, the probe, is allowed each probe interval.
+    """
+    def allow(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if not self.open:
+                return True
+            if now < self.next_probe:
+                return False
+            LOGGER.info('Probing the API')
+            self.probing = (self.next_probe, self.probe_interval)
+            self.next_probe = now + self.probe_interval
+            self.probe_interval = min(PROBE_MAX, self.probe_interval * 2)
+            return True
+
+    # The query allowed last wasn't sent after all, a probe is given back
+    def release(self):
+        with self.lock:
+            if self.probing is not None:
+                (self.next_probe, self.probe_interval) = self.probing
+                self.probing = None
+
+    def success(self):
+        with self.lock:
+            if self.open:
+                LOGGER.warning('API is responding again')
+            self.reset()
+
+    def failure(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            self.failures += 1
+            self.probing = None
+            if not self.open and self.failures >= FAILURE_THRESHOLD:
+                LOGGER.warning('{} API failures in a row, using saved data until it recovers'.format(self.failures))
+                self.open = True
+                self.next_probe = now + PROBE_MIN
+                self.probe_interval = 2 * PROBE_MIN
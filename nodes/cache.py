@@ -0,0 +1,77 @@
+#
+#  Persistent response cache
+#
+#  The last successful realtime and forecast data is saved, along with
+#  the time it was fetched and the location it was fetched for, in a
+#  small JSON file in the node server directory.  At start-up it is
+#  replayed through the normal publish path so the drivers have real
+#  values right away instead of waiting on the API.
+#
+#  Entries are only updated in memory by put(), the file is written by
+#  save() once per poll cycle and only when something changed.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import json
+import os
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+CACHE_FILE = 'climacell_cache.json'
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+            LOGGER.debug('Loaded cached data from ' + self.path)
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            LOGGER.warning('Ignoring unreadable cache file: ' + str(e))
+            self.entries = {}
+
+    """
+        Return (timestamp, data) for the entry or (0, None) if there is
+        nothing cached for this location.
+    """
+    def get(self, key, location):
+        entry = self.entries.get(key)
+        if entry is None or entry.get('location') != location:
+            return (0, None)
+        return (entry['time'], entry['data'])
+
+    def put(self, key, location, timestamp, data, write=False):
+        with self.lock:
+            self.entries[key] = {
+                    'location': location,
+                    'time': timestamp,
+                    'data': data,
+                    }
+            self.dirty = True
+        if write:
+            self.save()
+
+    # write to a temporary file first so a crash can't leave a partial file
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp = self.path + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(self.entries, f, separators=(',', ':'))
+                os.replace(tmp, self.path)
+                self.dirty = False
+            except Exception as e:
+                LOGGER.error('Failed to save cache: ' + str(e))
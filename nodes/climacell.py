@@ -11,15 +11,28 @@ except ImportError:
 import sys
 import time
 import datetime
-import requests
 import socket
 import math
 import re
 import json
+import concurrent.futures
 import node_funcs
 from datetime import timedelta
 from nodes import climacell_daily
+from nodes import climacell_conditions
+from nodes import site
+from nodes import api
+from nodes import astronomy
+from nodes import breaker
+from nodes import cache
+from nodes import fetcher
+from nodes import metrics
+from nodes import profiler
+from nodes import scheduler
 from nodes import uom
+from nodes import fields
+from nodes import et3
+from nodes import hourly_et
 from nodes import weather_codes as wx
 
 LOGGER = polyinterface.LOGGER
@@ -38,6 +51,17 @@ class Controller(polyinterface.Controller):
         self.latitude = 0
         self.longitude = 0
         self.force = True
+        self.api = api.Client()
+        self.fetcher = fetcher.FetchWorker(self.query_weather)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=api.POOL_SIZE)
+        self.cache = cache.ResponseCache()
+        self.scheduler = scheduler.Scheduler()
+        self.breaker = breaker.CircuitBreaker()
+        self.scheduler_saved = 0
+        self.scheduler_state = None
+        self.metrics = metrics.Metrics()
+        self.profiler = profiler.PollProfiler()
+        self.sites = []
 
         self.params = node_funcs.NSParameters([{
             'name': 'APIKey',
@@ -50,12 +74,16 @@ class Controller(polyinterface.Controller):
             'default': '-59.9 to 59.9',
             'isRequired': True,
             'notice': 'Latitude must be set',
+            'type': float,
+            'validator': lambda v: -90 <= v <= 90,
             },
             {
             'name': 'Longitude',
             'default': '-180 to 180',
             'isRequired': True,
             'notice': 'Longitude must be set',
+            'type': float,
+            'validator': lambda v: -180 <= v <= 180,
             },
             {
              'name': 'Units',
@@ -68,18 +96,80 @@ class Controller(polyinterface.Controller):
             'default': '0',
             'isRequired': False,
             'notice': '',
+            'type': int,
+            'validator': lambda v: v >= 0,
             },
             {
             'name': 'Elevation',
             'default': '0',
             'isRequired': False,
             'notice': '',
+            'type': float,
             },
             {
             'name': 'Plant Type',
             'default': '0.23',
             'isRequired': False,
             'notice': '',
+            'type': float,
+            'validator': lambda v: 0 <= v <= 1,
+            },
+            {
+            'name': 'ET Mode',
+            'default': 'daily',
+            'isRequired': False,
+            'notice': '',
+            'validator': lambda v: v in ('daily', 'hourly'),
+            },
+            {
+            'name': 'Locations',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Hourly Quota',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            'type': int,
+            'validator': lambda v: v >= 0,
+            },
+            {
+            'name': 'Nowcast',
+            'default': 'interpolate',
+            'isRequired': False,
+            'notice': '',
+            'validator': lambda v: v in ('interpolate', 'step', 'off'),
+            },
+            {
+            'name': 'Nowcast Age',
+            'default': '60',
+            'isRequired': False,
+            'notice': '',
+            'type': int,
+            'validator': lambda v: v > 0,
+            },
+            {
+            'name': 'API URL',
+            'default': api.BASE_URL,
+            'isRequired': False,
+            'notice': '',
+            'validator': lambda v: v.startswith(('http://', 'https://')),
+            },
+            {
+            'name': 'Metrics File',
+            'default': '',
+            'isRequired': False,
+            'notice': '',
+            },
+            {
+            'name': 'Profile Polls',
+            'default': '0',
+            'isRequired': False,
+            'notice': '',
+            'type': int,
+            'validator': lambda v: 0 <= v <= profiler.MAX_POLLS,
             },
             ])
 
@@ -91,125 +181,532 @@ class Controller(polyinterface.Controller):
         (valid, changed) = self.params.update_from_polyglot(config)
         if changed and not valid:
             LOGGER.debug('-- configuration not yet valid')
+            self.configured = False
             self.removeNoticesAll()
             self.params.send_notices(self)
         elif changed and valid:
             LOGGER.debug('-- configuration is valid')
             self.removeNoticesAll()
             self.configured = True
-            if self.params.isSet('Forecast Days'):
-                self.discover()
+            self.limit_forecast_days()
+            changes = set(self.params.changes())
+            LOGGER.debug('-- changed: {}'.format(changes))
+            # Applied on the fetch thread so it runs in order with the
+            # poll cycles, never while one is publishing.
+            self.fetcher.post(self.reconfigure, changes)
+            self.fetcher.request()
         elif valid:
             LOGGER.debug('-- configuration not changed, but is valid')
 
+    # Apply a configuration change, on the fetch worker thread
+    def reconfigure(self, changes):
+        if 'Latitude' in changes or 'Elevation' in changes:
+            et3.clear_astronomy_cache()
+        if 'Hourly Quota' in changes:
+            self.scheduler.set_rate(self.params.value('Hourly Quota'))
+        if 'Profile Polls' in changes:
+            self.profiler.start(self.params.value('Profile Polls'))
+        if changes & {'Latitude', 'Longitude', 'Elevation', 'Locations'}:
+            # locations that moved start over with no fetch history
+            self.build_sites()
+        if changes & {'Forecast Days', 'Units', 'Latitude', 'Longitude', 'Locations'}:
+            self.discover()
+        if 'APIKey' in changes:
+            self.breaker.reset()
+            for s in self.sites:
+                s.fetch_time = {'conditions': 0, 'forecast': 0}
+        elif 'ET Mode' in changes:
+            for s in self.sites:
+                s.fetch_time['forecast'] = 0
+
+        # Settings that only change how the data is presented are
+        # applied to the data we already have.
+        if changes & {'Units', 'Forecast Days'}:
+            self.republish()
+        elif changes & {'Plant Type', 'Elevation'}:
+            self.republish(et_only=True)
+
     def start(self):
         LOGGER.info('Starting node server')
         self.check_params()
+        try:
+            self.scheduler_state = self.polyConfig['customData'].get('scheduler')
+            self.scheduler.load(self.scheduler_state)
+        except:
+            pass
+        self.scheduler.set_rate(self.params.value('Hourly Quota'))
+        if self.params.value('Profile Polls') > 0:
+            self.profiler.start(self.params.value('Profile Polls'))
+        self.build_sites()
         self.discover()
         LOGGER.info('Node server started')
 
-        # Do an initial query to get filled in as soon as possible
-        self.query_conditions()
-        self.query_forecast()
-        self.force = False
+        # Publish the last saved data so the drivers have values right
+        # away, then query in the background. The fetch planner only
+        # queries if the saved data is older than the poll interval.
+        self.replay_cache()
+        self.fetcher.start()
+        self.fetcher.request()
 
     def longPoll(self):
         LOGGER.debug('longpoll')
-        self.query_forecast()
+        self.metrics.inc('polls_total', poll='long')
+        self.fetcher.request()
 
     def shortPoll(self):
-        self.query_conditions()
+        self.metrics.inc('polls_total', poll='short')
+        self.fetcher.request()
+
+    def poll_interval(self, key, default):
+        try:
+            return int(self.polyConfig[key])
+        except:
+            return default
+
+    """
+        Build the list of locations from the parameters.  Locations that
+        haven't moved keep their fetch state.
+    """
+    def build_sites(self):
+        old = {}
+        for s in self.sites:
+            old[(s.key, s.location())] = s
+
+        elevation = self.params.value('Elevation')
+        locations = [(self.name, self.params.value('Latitude'), self.params.value('Longitude'), elevation)]
+        locations += site.parse_locations(self.params.get('Locations'), elevation)
+
+        sites = []
+        for (index, (name, latitude, longitude, elev)) in enumerate(locations):
+            if index == 0:
+                key = ''
+                address = self.address
+            else:
+                key = 's' + str(index)
+                address = key
+
+            new_site = site.Site(key, name, latitude, longitude, elev, address)
+            if (key, new_site.location()) in old:
+                existing = old[(key, new_site.location())]
+                new_site.fetch_time = existing.fetch_time
+                new_site.tier_time = existing.tier_time
+                new_site.timelines = existing.timelines
+                new_site.hourly = existing.hourly
+                new_site.nowcast = existing.nowcast
+                new_site.history = existing.history
+                new_site.previous = existing.previous
+                new_site.pressure_ref = existing.pressure_ref
+                new_site.volatile_until = existing.volatile_until
+            sites.append(new_site)
+
+        LOGGER.info('Locations: ' + ', '.join([s.name + ' (' + s.location() + ')' for s in sites]))
+        self.sites = sites
+
+    # The node that displays the location's current conditions
+    def conditions_node(self, s):
+        if s.is_primary():
+            return self
+        return self.nodes[s.conditions_address]
+
+    """
+        Fetch planner.  Decide which data sets are due at this poll. Each
+        one is considered due a little before its poll interval expires so
+        that when shortPoll and longPoll fire together (in either order)
+        the first one picks up both and the second finds nothing to do.
+
+        The intervals are stretched by the scheduler when the API quota
+        won't last at the planned rate.  While the weather at the location
+        is changing quickly the configured intervals are used and the
+        forecast is fetched twice as often.
+
+        With nowcast replay the realtime data is only fetched when the
+        saved 5m series is older than 'Nowcast Age' or about to run out.
+    """
+    def plan_fetch(self, s):
+        now = time.time()
+        short_poll = self.poll_interval('shortPoll', 120)
+        long_poll = self.poll_interval('longPoll', 600)
+        replay = self.nowcast_mode() != 'off'
+
+        conditions_interval = self.conditions_interval()
+        if replay:
+            planned = 3600 / conditions_interval + 3600 / long_poll
+        else:
+            # forecast requests are combined with the conditions requests
+            # so the planned rate is one call per location per shortPoll
+            planned = 3600 / short_poll
+        forecast_interval = long_poll
+
+        if s.volatile(now):
+            conditions_interval = short_poll
+            forecast_interval = long_poll / 2
+        else:
+            stretch = self.scheduler.stretch(len(self.sites) * planned, now)
+            conditions_interval *= stretch
+            forecast_interval *= stretch
+
+        conditions = (now - s.fetch_time['conditions']) >= (conditions_interval - short_poll / 2)
+        if replay and s.nowcast.horizon(now) < 2 * short_poll:
+            conditions = True
+        forecast = False
+        if self.params.value('Forecast Days') > 0:
+            forecast = (now - s.fetch_time['forecast']) >= (forecast_interval - short_poll / 2)
+
+        # the realtime data comes along with the forecast for free
+        if forecast:
+            conditions = True
+
+        return (conditions, forecast)
+
+    # How often the realtime data is fetched, before any stretching
+    def conditions_interval(self):
+        short_poll = self.poll_interval('shortPoll', 120)
+        if self.nowcast_mode() == 'off':
+            return short_poll
+        return max(short_poll, self.params.value('Nowcast Age') * 60)
+
+    def nowcast_mode(self):
+        return self.params.value('Nowcast')
+
+    def hourly_mode(self):
+        return self.params.value('ET Mode') == 'hourly'
+
+    # Publish the saved realtime and forecast data from the last run
+    def replay_cache(self):
+        if not self.configured:
+            return
+
+        self.cache.load()
+        for s in self.sites:
+            try:
+                self.replay_site(s)
+            except Exception as e:
+                LOGGER.error('Failed to publish saved data for {}: {}'.format(s.name, e))
+
+    def replay_site(self, s):
+        (timestamp, saved) = self.cache.get(s.cache_key('history'), s.location())
+        if saved is not None:
+            s.history.load(saved)
+
+        (timestamp, intervals) = self.cache.get(s.cache_key('conditions'), s.location())
+        if intervals is not None:
+            LOGGER.info('Publishing saved conditions for {} from {}'.format(s.name, time.ctime(timestamp)))
+            if isinstance(intervals, dict):
+                # saved by a version that only kept the first interval
+                intervals = [intervals]
+            s.fetch_time['conditions'] = timestamp
+            s.timelines['5m'] = intervals
+            s.nowcast.set(intervals)
+            self.publish_nowcast(s, time.time())
+
+        (timestamp, hours) = self.cache.get(s.cache_key('hourly'), s.location())
+        if hours is not None and self.hourly_mode():
+            s.hourly.load(hours)
+            self.publish_et_today(s)
+
+        (timestamp, intervals) = self.cache.get(s.cache_key('forecast'), s.location())
+        if intervals is not None and self.params.value('Forecast Days') > 0:
+            # drop any days that are already over
+            today = datetime.datetime.utcfromtimestamp(time.time()) - timedelta(days=1)
+            intervals = [i for i in intervals if i['startTime'] > today.strftime('%Y-%m-%dT%H:%M:%SZ')]
+            if len(intervals) > 0:
+                LOGGER.info('Publishing saved forecast for {} from {}'.format(s.name, time.ctime(timestamp)))
+                s.fetch_time['forecast'] = timestamp
+                s.timelines['1d'] = intervals
+                self.publish_forecast(s, intervals)
+                self.force = False
 
     def query_conditions(self):
-        # Query for the current conditions. We can do this fairly
-        # frequently, probably as often as once a minute.
+        self.fetcher.request(conditions=True, forecast=False)
+
+    def query_forecast(self):
+        self.fetcher.request(conditions=False, forecast=True)
 
+    """
+        Query every location that has data due.  The locations are
+        fetched concurrently by a small pool of threads that share the
+        API client's connection pool.
+    """
+    def query_weather(self, conditions=None, forecast=None):
         if not self.configured:
             LOGGER.info('Skipping connection because we aren\'t configured yet.')
             return
 
+        with self.metrics.timer('cycle'):
+            if self.profiler.active:
+                self.profiler.run(self.query_sites, conditions, forecast)
+            else:
+                self.query_sites(conditions, forecast)
+
+    def query_sites(self, conditions, forecast):
+        jobs = []
+        received = {}
+        for s in self.sites:
+            (due_conditions, due_forecast) = self.plan_fetch(s)
+            if conditions is not None:
+                due_conditions = conditions
+            if forecast is not None:
+                due_forecast = forecast
+            if self.params.value('Forecast Days') < 1:
+                due_forecast = False
+            if due_conditions or due_forecast:
+                jobs.append((s, due_conditions, due_forecast))
+
+        if len(jobs) == 0:
+            LOGGER.debug('Nothing due, skipping query')
+        elif self.scheduler.backing_off():
+            LOGGER.debug('Backing off, skipping query')
+        elif len(jobs) == 1:
+            received[jobs[0][0]] = self.query_site(*jobs[0])
+        else:
+            futures = [(job[0], self.pool.submit(self.query_site, *job)) for job in jobs]
+            concurrent.futures.wait([f for (s, f) in futures])
+            for (s, f) in futures:
+                received[s] = f.result()
+
+        # The cache is updated once all the locations are in, so the
+        # query threads never wait on each other for it
+        with self.metrics.timer('cache'):
+            for (s, timesteps) in received.items():
+                self.cache_site(s, timesteps)
+            self.cache.save()
 
+        # Locations that didn't get new realtime data, because they
+        # weren't due or the query was held back or failed, get the
+        # current values from their saved realtime series
+        now = time.time()
+        if self.nowcast_mode() != 'off':
+            for s in self.sites:
+                if '5m' not in received.get(s, ()):
+                    self.publish_nowcast(s, now)
+
+        for s in self.sites:
+            self.publish_astronomy(s, now)
+        self.publish_status(now)
+        self.publish_metrics(now)
+
+        # first publish after start-up is forced
+        self.force = False
+        self.save_scheduler()
+        self.metrics.write(self.params.get('Metrics File'), now)
+
+    """
+        Save the scheduler state in custom data.  Material changes (back
+        off, limits, a real move in the remaining quota) are saved right
+        away, anything else at most every SAVE_INTERVAL seconds.
+    """
+    def save_scheduler(self, force=False):
+        now = time.time()
+        if not force and not self.scheduler.changed_since(self.scheduler_state):
+            if now - self.scheduler_saved < scheduler.SAVE_INTERVAL:
+                return
+
+        state = self.scheduler.save()
+        if state == self.scheduler_state:
+            return
+        self.scheduler_saved = now
+        self.scheduler_state = state
         try:
-            request = 'https://api.climacell.co/v3/weather/realtime?'
-            request += 'lat=' + self.params.get('Latitude')
-            request += '&lon=' + self.params.get('Longitude')
-            request += '&unit_system=' + self.params.get('Units')
-            request += '&fields=precipitation,precipitation_type,temp,feels_like,dewpoint,wind_speed,wind_gust,baro_pressure,visibility,humidity,wind_direction,fire_index,sunrise,sunset,cloud_cover,cloud_ceiling,cloud_base,surface_shortwave_radiation,moon_phase,weather_code,epa_aqi,epa_primary_pollutant,pm25,pm10,o3,no2,co,so2,epa_health_concern'
+            self.save_custom_data('scheduler', state)
+        except Exception as e:
+            LOGGER.error('Failed to save scheduler state: ' + str(e))
+
+    # Save the data a location just received for the next start-up
+    def cache_site(self, s, timesteps):
+        if '5m' in timesteps:
+            self.cache.put(s.cache_key('history'), s.location(), s.fetch_time['conditions'], s.history.save())
+            self.cache.put(s.cache_key('conditions'), s.location(), s.fetch_time['conditions'], s.timelines['5m'])
+        if '1h' in timesteps:
+            self.cache.put(s.cache_key('hourly'), s.location(), s.fetch_time['forecast'], s.hourly.save())
+        if '1d' in timesteps:
+            self.cache.put(s.cache_key('forecast'), s.location(), s.fetch_time['forecast'], s.timelines['1d'])
+
+    """
+        Query the timelines endpoint for one location, realtime (5m)
+        and daily (1d) data are combined into a single request when both
+        are needed.  In hourly ET mode the hourly (1h) data needed for
+        the ETo calculation is fetched along with the daily data.
 
-            # currently only supports metric units!
-            request = 'https://data.climacell.co/v4/timelines?'
-            request += 'location=' + self.params.get('Latitude') + ','
-            request += self.params.get('Longitude')
-            request += '&timesteps=5m'
-            request += '&fields=precipitationIntensity,precipitationType,temperature,temperatureApparent,dewPoint,windSpeed,windGust,pressureSeaLevel,visibility,humidity,windDirection,cloudCover,cloudCeiling,cloudBase,solarGHI,weatherCode,epaIndex'
+        Only the fields whose refresh tier is due are requested, the
+        rest are carried over from the previous data.
 
-            # sunrise/sunsetTime and moon phase require 1 day stimesteps
+        Returns the timesteps that were received, empty if the query was
+        held back or failed.
+    """
+    def query_site(self, s, conditions, forecast):
+        requested = time.time()
+        margin = self.poll_interval('shortPoll', 120) / 2
+        timesteps = []
+        request_fields = []
+        tiers = []
+        end_time = None
+        if conditions:
+            (due, due_tiers) = fields.due_fields('5m', s.tier_time, requested, margin)
+            timesteps.append('5m')
+            request_fields = api.merge_fields(request_fields, due)
+            tiers += [('5m', tier) for tier in due_tiers]
+        if forecast:
+            (due, due_tiers) = fields.due_fields('1d', s.tier_time, requested, margin)
+            timesteps.append('1d')
+            request_fields = api.merge_fields(request_fields, due)
+            tiers += [('1d', tier) for tier in due_tiers]
+            if self.hourly_mode():
+                timesteps.append('1h')
+                request_fields = api.merge_fields(request_fields, hourly_et.FIELDS)
+            # With only the daily timeline, limit it to the days we use.
+            # The endTime applies to every timeline in the request so leave
+            # it off when combined and let the API use each timestep's
+            # default range; extra days are ignored below.
+            if timesteps == ['1d']:
+                end_time = datetime.datetime.utcfromtimestamp(time.time()) + timedelta(days=(self.params.value('Forecast Days'))) + timedelta(minutes=1)
+
+        try:
+            request = api.timelines_request(s.latitude, s.longitude, timesteps, request_fields, end_time, base_url=self.params.get('API URL').rstrip('/'))
 
             headers = {
                     'apikey': self.params.get('APIKey'), 
                     'Content-Type': 'application/JSON'
                     }
 
-            c = requests.get(request, headers=headers)
-            jdata = c.json()
+            if not self.breaker.allow():
+                return set()
+            if not self.scheduler.take():
+                # if this was the breaker's probe it wasn't sent
+                self.breaker.release()
+                return set()
+
+            LOGGER.debug('QUERY: {}'.format(request))
+
+            start = time.perf_counter()
+            try:
+                c = self.api.get(request, headers=headers)
+            except Exception as e:
+                LOGGER.error('Weather query for {} failed: {}'.format(s.name, e))
+                self.metrics.api_call(time.perf_counter() - start, 'error')
+                self.metrics.api_error()
+                self.breaker.failure()
+                return set()
+            self.metrics.api_call(time.perf_counter() - start, c.status_code, len(c.content))
+
+            self.scheduler.record(c.status_code, c.headers)
+            if c.status_code != 200:
+                LOGGER.error('Weather query for {} failed with {}: {}'.format(s.name, c.status_code, c.text))
+                c.close()
+                self.metrics.api_error()
+                # rate limiting is handled by the scheduler
+                if c.status_code != 429:
+                    self.breaker.failure()
+                return set()
+
+            with self.metrics.timer('parse'):
+                try:
+                    jdata = c.json()
+                except ValueError:
+                    jdata = None
             c.close()
 
-            # data should be under 'data' / 'timelines' / [0] / 'intervals / [0]
+            if jdata == None or 'data' not in jdata:
+                LOGGER.error('Weather query for {} returned no data: {}'.format(s.name, jdata))
+                self.metrics.api_error()
+                self.breaker.failure()
+                return set()
+            self.breaker.success()
 
-            interval = jdata['data']['timelines'][0]['intervals'][0]
-            LOGGER.debug('REALTIME: {}'.format(interval))
+            # data is under 'data' / 'timelines' / [n] with one timeline
+            # per requested timestep. The hourly data has to be handled
+            # before the daily forecast that uses it.
+            now = time.time()
+            timelines = {}
+            for timeline in jdata['data']['timelines']:
+                timelines[timeline['timestep']] = timeline['intervals']
 
-            if jdata == None:
-                LOGGER.error('Current condition query returned no data')
-                return
+            for key in tiers:
+                s.tier_time[key] = requested
+            for timestep in ('5m', '1d'):
+                if timestep in timelines:
+                    fields.carry_over(s.timelines.get(timestep), timelines[timestep])
+                    s.timelines[timestep] = timelines[timestep]
 
-            values = interval['values']
-        
-            """
-            All values are metric so we will have to do the conversions
-            before sending the data to the ISY if the user want's something
-            else.
-            """
-            u = self.params.get('Units')
-            if 'temperature' in values:
-                LOGGER.debug('TEMPERATURE: {} {}'.format(u, values['temperature']))
-                v = uom.conversion('CLITEMP', u, values['temperature'])
-                self.update_driver('CLITEMP', v)
-            if 'humidity' in values:
-                self.update_driver('CLIHUM', values['humidity'])
-            if 'pressureSeaLevel' in values:
-                v = uom.conversion('BARPRES', u, values['pressureSeaLevel'])
-                self.update_driver('BARPRES', v)
-            if 'windSpeed' in values:
-                v = uom.conversion('SPEED', u, values['windSpeed'])
-                self.update_driver('SPEED', v)
-            if 'windGust' in values:
-                v = uom.conversion('SPEED', u, values['windGust'])
-                self.update_driver('GV5', v)
-            if 'windDirection' in values:
-                self.update_driver('WINDDIR', values['windDirection'])
-            if 'visibility' in values:
-                v = uom.conversion('DISTANC', u, values['visibility'])
-                self.update_driver('DISTANC', v)
-            if 'precipitationIntensity' in values:
-                v = uom.conversion('RAINRT', u, values['precipitationIntensity'])
-                self.update_driver('RAINRT', v)
-            if 'dewPoint' in values:
-                v = uom.conversion('DEWPT', u, values['dewPoint'])
-                self.update_driver('DEWPT', v)
-            if 'temperatureApparent' in values:
-                v = uom.conversion('GV2', u, values['temperatureApparent'])
-                self.update_driver('GV2', v)
-            if 'solarGHI' in values:
-                self.update_driver('SOLRAD', values['solarGHI'])
-            if 'cloudCover' in values:
-                self.update_driver('GV14', values['cloudCover'])
-            if 'weatherCode' in values:
-                LOGGER.debug('weather code = {}'.format(values['weatherCode']))
-                self.update_driver('GV13', values['weatherCode'])
-            if 'epaIndex' in values:
-                self.update_driver('GV17', values['epaIndex'])
+            if '5m' in timelines:
+                s.fetch_time['conditions'] = now
+                s.nowcast.set(timelines['5m'])
+                s.check_volatility(timelines['5m'][0]['values'], now)
+                self.publish_nowcast(s, now)
+            if '1h' in timelines:
+                self.publish_hourly(s, timelines['1h'])
+            if '1d' in timelines:
+                s.fetch_time['forecast'] = now
+                self.publish_forecast(s, timelines['1d'])
 
+            return set(timelines)
+
+        except Exception as e:
+            LOGGER.error('Weather query failure for ' + s.name)
+            LOGGER.error(e)
+
+        return set()
+
+    """
+        Publish again from the data in memory, no API calls.  For a
+        change of units everything is converted again, with et_only just
+        the ETo values are recalculated (plant type or elevation change).
+        Forecast days that aren't in memory are fetched at the next poll.
+    """
+    def republish(self, et_only=False):
+        if not self.configured:
+            return
+
+        now = time.time()
+        plant_type = self.params.value('Plant Type')
+        force = self.force
+        self.force = not et_only
+        for s in self.sites:
+            try:
+                if self.hourly_mode():
+                    s.hourly.recalculate(s.latitude, s.longitude, s.elevation, plant_type)
+                    self.publish_et_today(s)
+
+                if not et_only:
+                    values = self.nowcast_values(s, now)
+                    if values is not None:
+                        self.publish_conditions(s, values)
+                    self.publish_history(s)
+                    self.publish_astronomy(s, now)
+
+                intervals = s.timelines.get('1d', [])
+                if len(intervals) > 0:
+                    self.publish_forecast(s, intervals, et_only)
+                if len(intervals) < self.params.value('Forecast Days'):
+                    s.fetch_time['forecast'] = 0
+            except Exception as e:
+                LOGGER.error('Failed to publish data for {}: {}'.format(s.name, e))
+
+        if not et_only:
+            self.publish_status(now)
+        self.force = force
+
+    # The realtime values for the time now
+    def nowcast_values(self, s, now):
+        if self.nowcast_mode() == 'off':
+            return s.nowcast.at(0)
+        return s.nowcast.at(now, self.nowcast_mode() == 'interpolate')
+
+    # Publish the realtime values for the time now
+    def publish_nowcast(self, s, now):
+        values = self.nowcast_values(s, now)
+        if values is not None:
+            self.publish_conditions(s, values)
+            s.history.add(now, values)
+            self.publish_history(s)
+
+    def publish_conditions(self, s, values):
+        LOGGER.debug('REALTIME: {}'.format(values))
+
+        try:
+            # All values are metric, the compiled field mapping takes
+            # care of any conversions the user's units require.
+            with self.metrics.timer('conditions'):
+                self.conditions_node(s).update_mapped(values)
 
             '''
             TODO:
@@ -219,61 +716,148 @@ class Controller(polyinterface.Controller):
             LOGGER.error('Current observation update failure')
             LOGGER.error(e)
 
-    def query_forecast(self):
-        if not self.configured:
-            LOGGER.info('Skipping connection because we aren\'t configured yet.')
-            return
+    # Rolling statistics from the observation history
+    def publish_history(self, s):
+        node = self.conditions_node(s)
+        units = self.params.value('Units')
+        try:
+            for (driver, value, prec) in (
+                    ('GV6', s.history.rain_24h(), 3),
+                    ('GV0', s.history.temperature_high(), 1),
+                    ('GV1', s.history.temperature_low(), 1),
+                    ('GV21', s.history.pressure_tendency(), 3)):
+                if value is not None:
+                    node.update_driver(driver, uom.conversion(driver, units, value), self.force, prec)
+        except Exception as e:
+            LOGGER.error('History update failure: ' + str(e))
 
-        if int(self.params.get('Forecast Days')) < 1:
-            return
+    """
+        Report how old the realtime data is (GV26, minutes) for each
+        location.  ST is 0 while the API is failing or the main location's
+        data is more than twice as old as it should get.
+    """
+    def publish_status(self, now):
+        stale_age = 2 * self.conditions_interval()
+        stale = self.breaker.is_open()
+        for s in self.sites:
+            fetched = s.fetch_time['conditions']
+            if fetched == 0:
+                continue
+            age = now - fetched
+            self.conditions_node(s).update_driver('GV26', age / 60, self.force, 0)
+            if s.is_primary() and age > stale_age:
+                stale = True
+
+        self.update_driver('ST', 0 if stale else 1, self.force)
+
+    # Headline metrics on the controller, everything else goes in the
+    # metrics file
+    def publish_metrics(self, now):
+        for period in ('hour', 'day'):
+            if self.scheduler.remaining[period] is not None:
+                self.metrics.set('api_quota_remaining', self.scheduler.remaining[period], period=period)
+        self.metrics.set('breaker_open', 1 if self.breaker.is_open() else 0)
+        calls = self.metrics.calls_last_hour(now)
+        self.metrics.set('api_calls_last_hour', calls)
 
+        if self.metrics.last_latency is not None:
+            self.update_driver('GV27', self.metrics.last_latency * 1000, self.force, 0)
+        self.update_driver('GV28', calls, self.force, 0)
+        self.update_driver('GV29', self.metrics.errors, self.force, 0)
+
+    # Sun and moon, calculated locally. The sunrise/sunset values are
+    # cached so they're only calculated once a day.
+    def publish_astronomy(self, s, now):
+        node = self.conditions_node(s)
         try:
-            enddate = datetime.datetime.utcnow() + timedelta(days=(int(self.params.get('Forecast Days')))) + timedelta(minutes=1)
-
-            request = 'https://api.climacell.co/v3/weather/forecast/daily?'
-            request += 'lat=' + self.params.get('Latitude')
-            request += '&lon=' + self.params.get('Longitude')
-            request += '&unit_system=' + self.params.get('Units')
-            request += '&start_time=now'
-            request += '&end_time=' + enddate.strftime('%Y-%m-%dT%H:%M:%SZ')
-            request += '&fields=precipitation,precipitation_accumulation,temp,feels_like,wind_speed,baro_pressure,visibility,humidity,wind_direction,precipitation_probability,moon_phase,weather_code'
-
-            request = 'https://data.climacell.co/v4/timelines?'
-            request += 'location=' + self.params.get('Latitude') + ','
-            request += self.params.get('Longitude')
-            request += '&timesteps=1d'
-            #request += '&startTime=now'
-            request += '&endTime=' + enddate.strftime('%Y-%m-%dT%H:%M:%SZ')
-            request += '&fields=precipitationIntensity,precipitationType,precipitationProbability,temperatureMin,temperatureMax,temperatureApparent,dewPoint,windSpeedMin,windSpeedMax,windSpeedAvg,windGust,pressureSeaLevelMin,pressureSeaLevelMax,visibility,humidityMin,humidityMax,humidityAvg,windDirection,cloudCover,cloudCeiling,cloudBase,solarGHI,weatherCode,moonPhase'
+            local = time.localtime(now)
+            (sunrise, sunset, length) = astronomy.sun_times(s.latitude, s.longitude, local.tm_year, local.tm_mon, local.tm_mday)
+            if sunrise is not None:
+                node.update_driver('GV22', astronomy.local_hours(sunrise), self.force, 2)
+                node.update_driver('GV23', astronomy.local_hours(sunset), self.force, 2)
+            node.update_driver('GV24', length, self.force, 2)
+            node.update_driver('GV25', astronomy.solar_elevation(s.latitude, s.longitude, now), self.force, 1)
+            node.update_driver('GV9', astronomy.moon_phase(now), self.force)
+        except Exception as e:
+            LOGGER.error('Astronomy update failure: ' + str(e))
 
-            headers = {
-                    'apikey': self.params.get('APIKey'), 
-                    'Content-Type': 'application/JSON'
-                    }
+    # Calculate ETo for any new hours and update today's running total
+    def publish_hourly(self, s, intervals):
+        try:
+            s.hourly.update(intervals, s.latitude, s.longitude, s.elevation, self.params.value('Plant Type'))
+            self.publish_et_today(s)
+        except Exception as e:
+            LOGGER.error('Hourly ETo failure: ' + str(e))
 
-            LOGGER.debug('-------------')
-            LOGGER.debug('FORECAST: {}'.format(request))
+    def publish_et_today(self, s):
+        et0 = s.hourly.today()
+        v = uom.conversion('GV20', self.params.value('Units'), et0)
+        self.conditions_node(s).update_driver('GV20', v, self.force)
 
-            c = requests.get(request, headers=headers)
-            jdata = c.json()
-            c.close()
+    def publish_forecast(self, s, intervals, et_only=False):
+        LOGGER.debug('FORECAST: {}'.format(intervals))
 
-            LOGGER.debug('FORECAST: {}'.format(jdata))
-            intervals = jdata['data']['timelines'][0]['intervals']
-            LOGGER.debug('FORECAST: {}'.format(intervals))
-            #LOGGER.debug('-------------')
+        with self.metrics.timer('forecast'):
+            self.publish_forecast_days(s, intervals, et_only)
 
+    def publish_forecast_days(self, s, intervals, et_only):
+        try:
             # Records are for each day, midnight to midnight
-            day = 0
-            LOGGER.debug('Processing periods: %d' % len(intervals))
-            for forecast in intervals:
-                address = 'forecast_' + str(day)
+            intervals = intervals[:self.params.value('Forecast Days')]
+
+            # Use the sum of the hourly values for the days that are
+            # completely covered by the hourly data.
+            hourly = [None] * len(intervals)
+            if self.hourly_mode():
+                for day in range(0, len(intervals)):
+                    start = api.parse_time(intervals[day]['startTime'])
+                    hourly[day] = s.hourly.total(start, start + 86400, complete=True)
+
+            # Skip the days that haven't changed since they were last
+            # published. After midnight each day moves down one node,
+            # those are copied from the node that was showing them.
+            context = (self.params.value('Units'), self.params.value('Plant Type'), s.latitude, s.elevation)
+            shown_at = {}
+            for (address, shown) in s.shown.items():
+                shown_at[shown] = address
+
+            update = []
+            for day in range(0, len(intervals)):
+                address = s.forecast_address(day)
+                key = (intervals[day]['startTime'], climacell_daily.fingerprint(intervals[day], context + (hourly[day],)))
+                if not self.force and s.shown.get(address) == key:
+                    continue
+                source = shown_at.get(key)
+                if not self.force and not et_only and source is not None and source in self.nodes:
+                    if self.nodes[address].copy_forecast(self.nodes[source], self.force):
+                        LOGGER.debug(' >>>>   period ' + key[0] + '  ' + source + ' -> ' + address)
+                        s.shown[address] = key
+                        continue
+                update.append((day, key))
+
+            LOGGER.debug('Processing periods: %d of %d' % (len(update), len(intervals)))
+            if len(update) == 0:
+                return
+
+            try:
+                with self.metrics.timer('et0'):
+                    et0 = climacell_daily.forecast_et0([intervals[day] for (day, key) in update], s.latitude, s.elevation, self.params.value('Plant Type'))
+            except Exception as e:
+                LOGGER.error('ETo calculation failure: ' + str(e))
+                et0 = [None] * len(update)
+
+            for (i, (day, key)) in enumerate(update):
+                forecast = intervals[day]
+                address = s.forecast_address(day)
+                if hourly[day] is not None:
+                    et0[i] = hourly[day]
                 LOGGER.debug(' >>>>   period ' + forecast['startTime'] + '  ' + address)
                 LOGGER.debug(forecast)
-                self.nodes[address].update_forecast(forecast, self.params.get('Latitude'), self.params.get('Elevation'), self.params.get('Plant Type'), self.force)
-                day += 1
-                if day >= int(self.params.get('Forecast Days')):
-                    return
+                if et_only and address in s.shown:
+                    self.nodes[address].update_et0(et0[i], self.force)
+                else:
+                    self.nodes[address].update_forecast(forecast, et0[i], self.force)
+                s.shown[address] = key
 
         except Exception as e:
             LOGGER.error('Forecast data failure: ' + str(e))
@@ -283,31 +867,82 @@ class Controller(polyinterface.Controller):
         for node in self.nodes:
             self.nodes[node].reportDrivers()
 
+    """
+        Bring the forecast and location nodes in line with the settings.
+        Only the difference between the nodes we want and the nodes
+        Polyglot already has is sent to Polyglot, nodes it already knows
+        about are just registered here.  The driver units are set before
+        any node is registered so nothing is published without them.
+    """
     def discover(self, *args, **kwargs):
-        # Create any additional nodes here
         LOGGER.info("In Discovery...")
 
-        num_days = int(self.params.get('Forecast Days'))
-        if num_days < 15:
-            # delete any extra days
-            for day in range(num_days, 15):
-                address = 'forecast_' + str(day)
+        units = self.params.value('Units')
+        num_days = self.params.value('Forecast Days')
+        self.set_driver_uom(units)
+
+        wanted = {}
+        for s in self.sites:
+            if not s.is_primary():
+                wanted[s.conditions_address] = (climacell_conditions.ConditionsNode, s.name, s)
+            for day in range(0, num_days):
+                wanted[s.forecast_address(day)] = (climacell_daily.DailyNode, s.forecast_name(day), s)
+
+        # delete forecast and location nodes that are no longer needed
+        existing = set(self.polyglot_nodes()) | set(self.nodes)
+        for address in sorted(existing - set(wanted)):
+            if re.match(r'^(forecast_[0-9]+|s[0-9]+(_f[0-9]+)?)$', address):
                 try:
                     self.delNode(address)
                 except:
                     LOGGER.debug('Failed to delete node ' + address)
 
-        for day in range(0,num_days):
-            address = 'forecast_' + str(day)
-            title = 'Forecast ' + str(day)
+        added = 0
+        for (address, (node_class, name, s)) in wanted.items():
             try:
-                node = climacell_daily.DailyNode(self, self.address, address, title)
-                self.addNode(node)
-            except Excepton as e:
-                LOGGER.error('Failed to create forecast node ' + title)
+                if self.reconcile_node(node_class, address, name, units):
+                    added += 1
+                    # a new node object hasn't shown anything yet
+                    s.shown.pop(address, None)
+            except Exception as e:
+                LOGGER.error('Failed to create node ' + name)
                 LOGGER.error(e)
 
-        self.set_driver_uom(self.params.get('Units'))
+        LOGGER.info('Discovery done, {} nodes added'.format(added))
+
+    """
+        Make sure there's a node object for the address.  Returns True if
+        a new node object was created.  Only nodes Polyglot doesn't have
+        yet (or has with a different name or type) are added to Polyglot.
+    """
+    def reconcile_node(self, node_class, address, name, units):
+        current = self.nodes.get(address)
+        if isinstance(current, node_class) and current.name == name:
+            return False
+
+        node = node_class(self, self.address, address, name)
+        node.set_driver_uom(units)
+
+        known = self.polyglot_nodes().get(address)
+        if known is not None and known.get('name') == name and known.get('node_def_id', node.id) == node.id:
+            # Polyglot has it, start with the driver values it has
+            node.updateDrivers(known['drivers'])
+            for driver in node.drivers:
+                for saved in known['drivers']:
+                    if driver['driver'] == saved['driver']:
+                        driver['value'] = saved['value']
+            self.nodes[address] = node
+            node.start()
+        else:
+            self.addNode(node)
+        return True
+
+    # The nodes Polyglot has for this node server, by address
+    def polyglot_nodes(self):
+        try:
+            return {n['address']: n for n in self.polyConfig['nodes']}
+        except:
+            return {}
 
     # Delete the node server from Polyglot
     def delete(self):
@@ -315,20 +950,36 @@ class Controller(polyinterface.Controller):
 
     def stop(self):
         LOGGER.info('Stopping node server')
+        self.fetcher.stop()
+        self.pool.shutdown(wait=False)
+        for s in self.sites:
+            self.cache.put(s.cache_key('history'), s.location(), time.time(), s.history.save())
+        self.cache.save()
+        self.save_scheduler(force=True)
+        self.metrics.write(self.params.get('Metrics File'), force=True)
+        self.api.close()
 
     def update_profile(self, command):
         st = self.poly.installprofile()
         return st
 
+    # Profile the next N poll cycles, see nodes/profiler.py
+    def profile_polls(self, command):
+        try:
+            polls = int(command.get('value', 5))
+        except Exception:
+            polls = 5
+        self.profiler.start(polls)
+        if self.profiler.active:
+            self.fetcher.request()
+
     def check_params(self):
         self.removeNoticesAll()
 
         if self.params.get_from_polyglot(self):
             LOGGER.debug('All required parameters are set!')
             self.configured = True
-            if int(self.params.get('Forecast Days')) > 15:
-                addNotice('Number of days of forecast data is limited to 15 days', 'forecast')
-                self.params.set('Forecast Days', 15)
+            self.limit_forecast_days()
         else:
             LOGGER.debug('Configuration required.')
             LOGGER.debug('APIKey = ' + self.params.get('APIKey'))
@@ -336,13 +987,25 @@ class Controller(polyinterface.Controller):
             LOGGER.debug('Longitude = ' + self.params.get('Longitude'))
             self.params.send_notices(self)
 
+    # The daily timeline has at most 15 days
+    def limit_forecast_days(self):
+        if self.params.value('Forecast Days') > 15:
+            self.addNotice('Number of days of forecast data is limited to 15 days', 'forecast')
+            self.params.set('Forecast Days', 15)
+
     # Set the uom dictionary based on current user units preference
     def set_driver_uom(self, units):
         LOGGER.info('Configure driver units to ' + units)
         self.uom = uom.get_uom(units)
-        for day in range(0, int(self.params.get('Forecast Days'))):
-            address = 'forecast_' + str(day)
-            self.nodes[address].set_driver_uom(units)
+        self.mapping = fields.compile_mapping(fields.CONDITIONS, units)
+        for s in self.sites:
+            addresses = [s.forecast_address(day) for day in range(0, self.params.value('Forecast Days'))]
+            if not s.is_primary():
+                addresses.append(s.conditions_address)
+            # nodes that don't exist yet get their units when they're created
+            for address in addresses:
+                if address in self.nodes:
+                    self.nodes[address].set_driver_uom(units)
 
     def remove_notices_all(self, command):
         self.removeNoticesAll()
@@ -371,6 +1034,7 @@ class Controller(polyinterface.Controller):
             'UPDATE_PROFILE': update_profile,
             'REMOVE_NOTICES_ALL': remove_notices_all,
             'DEBUG': set_logging_level,
+            'PROFILE': profile_polls,
             }
 
     # For this node server, all of the info is available in the single
@@ -391,6 +1055,20 @@ class Controller(polyinterface.Controller):
             {'driver': 'DISTANC', 'value': 0, 'uom': 83},  # visibility
             {'driver': 'SOLRAD', 'value': 0, 'uom': 74},   # solar radiataion
             {'driver': 'GV17', 'value': 0, 'uom': 56},     # aqi
+            {'driver': 'GV20', 'value': 0, 'uom': 106},    # ETo so far today
+            {'driver': 'GV6', 'value': 0, 'uom': 82},      # rain last 24 hours
+            {'driver': 'GV0', 'value': 0, 'uom': 4},       # high temp last 24 hours
+            {'driver': 'GV1', 'value': 0, 'uom': 4},       # low temp last 24 hours
+            {'driver': 'GV21', 'value': 0, 'uom': 117},    # pressure change last 3 hours
+            {'driver': 'GV22', 'value': 0, 'uom': 20},     # sunrise
+            {'driver': 'GV23', 'value': 0, 'uom': 20},     # sunset
+            {'driver': 'GV24', 'value': 0, 'uom': 20},     # day length
+            {'driver': 'GV25', 'value': 0, 'uom': 14},     # solar elevation
+            {'driver': 'GV9', 'value': 0, 'uom': 25},      # moon phase
+            {'driver': 'GV26', 'value': 0, 'uom': 45},     # data age
+            {'driver': 'GV27', 'value': 0, 'uom': 42},     # last API latency
+            {'driver': 'GV28', 'value': 0, 'uom': 56},     # API calls last hour
+            {'driver': 'GV29', 'value': 0, 'uom': 56},     # API errors
             {'driver': 'GVP', 'value': 30, 'uom': 25},     # log level
             ]
 
@@ -0,0 +1,48 @@
+# Node definition for the current conditions at an additional location
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+from nodes import uom
+from nodes import fields
+import node_funcs
+
+LOGGER = polyinterface.LOGGER
+
+@node_funcs.add_functions_as_methods(node_funcs.functions)
+class ConditionsNode(polyinterface.Node):
+    id = 'conditions'
+    drivers = [
+            {'driver': 'CLITEMP', 'value': 0, 'uom': 4},   # temperature
+            {'driver': 'CLIHUM', 'value': 0, 'uom': 22},   # humidity
+            {'driver': 'DEWPT', 'value': 0, 'uom': 4},     # dewpoint
+            {'driver': 'BARPRES', 'value': 0, 'uom': 117}, # pressure
+            {'driver': 'WINDDIR', 'value': 0, 'uom': 76},  # direction
+            {'driver': 'SPEED', 'value': 0, 'uom': 49},    # wind speed
+            {'driver': 'GV5', 'value': 0, 'uom': 49},      # gust speed
+            {'driver': 'GV2', 'value': 0, 'uom': 4},       # feels like
+            {'driver': 'RAINRT', 'value': 0, 'uom': 46},   # rain
+            {'driver': 'GV13', 'value': 0, 'uom': 25},     # climate conditions
+            {'driver': 'GV14', 'value': 0, 'uom': 22},     # cloud conditions
+            {'driver': 'DISTANC', 'value': 0, 'uom': 83},  # visibility
+            {'driver': 'SOLRAD', 'value': 0, 'uom': 74},   # solar radiataion
+            {'driver': 'GV17', 'value': 0, 'uom': 56},     # aqi
+            {'driver': 'GV20', 'value': 0, 'uom': 106},    # ETo so far today
+            {'driver': 'GV6', 'value': 0, 'uom': 82},      # rain last 24 hours
+            {'driver': 'GV0', 'value': 0, 'uom': 4},       # high temp last 24 hours
+            {'driver': 'GV1', 'value': 0, 'uom': 4},       # low temp last 24 hours
+            {'driver': 'GV21', 'value': 0, 'uom': 117},    # pressure change last 3 hours
+            {'driver': 'GV22', 'value': 0, 'uom': 20},     # sunrise
+            {'driver': 'GV23', 'value': 0, 'uom': 20},     # sunset
+            {'driver': 'GV24', 'value': 0, 'uom': 20},     # day length
+            {'driver': 'GV25', 'value': 0, 'uom': 14},     # solar elevation
+            {'driver': 'GV9', 'value': 0, 'uom': 25},      # moon phase
+            {'driver': 'GV26', 'value': 0, 'uom': 45},     # data age
+            ]
+
+    def set_driver_uom(self, units):
+        self.uom = uom.get_uom(units)
+        self.units = units
+        self.mapping = fields.compile_mapping(fields.CONDITIONS, units)
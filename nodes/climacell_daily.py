@@ -7,9 +7,12 @@ except ImportError:
 
 import json
 import time
+import calendar
 import datetime
 from nodes import et3
 from nodes import uom
+from nodes import fields
+from nodes import astronomy
 from nodes import weather_codes as wx
 import node_funcs
 
@@ -36,10 +39,24 @@ class DailyNode(polyinterface.Node):
     def set_driver_uom(self, units):
         self.uom = uom.get_uom(units)
         self.units = units
+        self.mapping = fields.compile_mapping(fields.FORECAST, units)
 
     def mm2inch(self, mm):
         return mm/25.4
 
+    """
+        Show what another forecast node is showing, using the values it
+        last sent.  Used when the days shift at midnight.  Returns False
+        if the other node hasn't sent anything yet.
+    """
+    def copy_forecast(self, other, force):
+        last_sent = getattr(other, 'last_sent', None)
+        if not last_sent:
+            return False
+        for (driver, (value, sent)) in list(last_sent.items()):
+            self.update_driver(driver, value, force)
+        return True
+
 
     def get_min_max(self, key, data):
         min_val = 0
@@ -53,82 +70,88 @@ class DailyNode(polyinterface.Node):
 
         return (min_val, max_val)
 
-    def update_forecast(self, forecast, latitude, elevation, plant_type, force):
+    """
+        Publish one day of forecast data.  et0 is the day's ETo in mm,
+        calculated by the controller for all the forecast days at once.
+    """
+    def update_forecast(self, forecast, et0, force):
+        with self.controller.metrics.timer('update_forecast'):
+            self.update_forecast_drivers(forecast, et0, force)
 
+    def update_forecast_drivers(self, forecast, et0, force):
         try:
-            (date, time) = forecast['startTime'].split('T')
-            (year, month, day) = date.split('-')
-            forecast_day = datetime.datetime(int(year), int(month), int(day))
-            dow = forecast_day.weekday()
+            dow = forecast_date(forecast).weekday()
         except Exception as e:
             LOGGER.error('get day of week: ' + str(e))
             dow = 0
 
         values = forecast['values']
-
-        humidity = forecast['values']['humidityAvg']
-        hmax = values['humidityMax']
-        hmin = values['humidityMin']
-        LOGGER.debug('humidity = {}'.format(humidity))
+        LOGGER.debug('humidity = {}'.format(values.get('humidityAvg')))
 
         try:
-            tmax = values['temperatureMax']
-            tmin = values['temperatureMin']
-            v = uom.conversion('GV0', self.units, values['temperatureMax'])
-            self.update_driver('GV0', v, force, prec=1)
-            v = uom.conversion('GV1', self.units, values['temperatureMin'])
-            self.update_driver('GV1', v, force, prec=1)
-            self.update_driver('CLIHUM', humidity, force, prec=0)
-
-            # TODO: min/max pressure
-            v = uom.conversion('BARPRES', self.units, values['pressureSeaLevelMax'])
-            self.update_driver('BARPRES', v, force, prec=1)
-
             # V4 API no longer supports accumulation
             # rate: self.update_driver('GV6', forecast['preciptiation'][0]['max']['value'], force, prec=1)
 
-            #self.update_driver('GV6', forecast['precipitation_accumulation']['value'], force, prec=1)
+            #TODO: add visibility(min/max), feelslike(min/max)
 
-            v = uom.conversion('RAINRT', self.units, values['precipitationIntensity'])
-            self.update_driver('RAINRT', v, force, prec=3)
-
-            Ws = values['windSpeedAvg']
-            v = uom.conversion('GV7', self.units, values['windSpeedMax'])
-            self.update_driver('GV7', v, force, prec=1)
-            v = uom.conversion('GV8', self.units, values['windSpeedMin'])
-            self.update_driver('GV8', v, force, prec=1)
+            self.update_mapped(values, force)
             self.update_driver('GV19', int(dow), force)
-            self.update_driver('GV18', values['precipitationProbability'], force, prec=1)
-
-            #TODO: add visibility(min/max), moon phase, feelslike(min/max)
-
-            #LOGGER.debug('Forecast coded weather = ' + forecast['weather_code']['value'])
-            self.update_driver('GV13', values['weatherCode'], force)
-
-            self.update_driver('GV9', values['moonPhase'])
-
+            self.update_driver('GV9', astronomy.moon_phase(forecast_noon(forecast)), force)
 
         except Exception as e:
             LOGGER.error('Forcast: ' + str(e))
 
-        # Calculate ETo
-        #  Temp is in degree C and windspeed is in m/s, we may need to
-        #  convert these.
-        #J = datetime.datetime.fromtimestamp(epoch).timetuple().tm_yday
-        J = forecast_day.timetuple().tm_yday
+        self.update_et0(et0, force)
 
-        try:
-            if self.units != 'si':
-                LOGGER.info('Conversion of temperature/wind speed required')
-                tmin = et3.FtoC(tmin)
-                tmax = et3.FtoC(tmax)
-                Ws = et3.mph2ms(Ws)
-        except Exception as e:
-            LOGGER.error('conversion issue: ' + str(e))
+    # Publish the day's ETo, et0 is in mm
+    def update_et0(self, et0, force):
+        if et0 is None:
+            return
 
-        et0 = et3.evapotranspriation(tmax, tmin, None, Ws, float(elevation), hmax, hmin, float(latitude), float(plant_type), J)
-        if self.units == 'metric' or self.units == 'si' or self.units.startswith('m'):
+        if uom.is_metric(self.units.lower()):
             self.update_driver('GV20', round(et0, 2), force)
         else:
             self.update_driver('GV20', self.mm2inch(et0), force, prec=3)
         LOGGER.info("ETo = %f %f" % (et0, self.mm2inch(et0)))
+
+
+# The date a forecast interval is for
+def forecast_date(forecast):
+    (date, time) = forecast['startTime'].split('T')
+    (year, month, day) = date.split('-')
+    return datetime.datetime(int(year), int(month), int(day))
+
+"""
+    Fingerprint of a forecast interval and everything else that goes
+    into the published values (units, ETo settings).  Days with the same
+    fingerprint as last time don't need to be published again.
+"""
+def fingerprint(forecast, context):
+    return hash((forecast['startTime'], tuple(sorted(forecast['values'].items())), context))
+
+# Noon UTC (epoch seconds) of the day a forecast interval is for
+def forecast_noon(forecast):
+    return calendar.timegm(forecast_date(forecast).timetuple()) + 43200
+
+def day_of_year(forecast):
+    return forecast_date(forecast).timetuple().tm_yday
+
+"""
+    Calculate ETo for a list of daily forecast intervals in one batch.
+    The API data is always metric (degree C and m/s) which is what the
+    ETo calculation wants.  Returns a list with the ETo, in mm, for each
+    day.
+"""
+def forecast_et0(intervals, latitude, elevation, plant_type):
+    values = [f['values'] for f in intervals]
+    return et3.evapotranspiration_batch(
+            [v['temperatureMax'] for v in values],
+            [v['temperatureMin'] for v in values],
+            None,
+            [v['windSpeedAvg'] for v in values],
+            elevation,
+            [v['humidityMax'] for v in values],
+            [v['humidityMin'] for v in values],
+            latitude,
+            plant_type,
+            [day_of_year(f) for f in intervals])
@@ -5,6 +5,12 @@
 # http://edis.ifas.ufl.edu/pdffiles/ae/ae45900.pdf
 
 import math
+from functools import lru_cache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Formulas and constants
 vaporRate = 237.3
@@ -104,6 +110,55 @@ def calc_solar_radiation(t_min, t_max, lat, declination, julian_day):
     return Rs
     
 
+"""
+    Astronomy table.  The relative earth sun distance, solar declination,
+    sunset hour angle, extraterrestrial and clear sky radiation only
+    depend on the latitude, elevation and day of the year so they're
+    computed once and remembered.  The key is rounded (latitude to
+    0.001 degree, elevation to 0.1 meter) so small differences in the
+    configured values share entries, and the cache size is bounded.
+
+    Returns (dist, declination, latitude_r, angle, Ra, Rso, Ra_estimate)
+    where Ra_estimate is the radiation term used by the temperature based
+    solar radiation estimate (see calc_solar_radiation).
+"""
+ASTRONOMY_CACHE_SIZE = 2048
+
+def astronomy(latitude, elevation, julian_day):
+    return astronomy_terms(round(float(latitude), 3), round(float(elevation), 1), int(julian_day))
+
+@lru_cache(maxsize=ASTRONOMY_CACHE_SIZE)
+def astronomy_terms(latitude, elevation, julian_day):
+    # step 12.1, relative sun earth distance
+    dist = relative_earth_sun_distance(julian_day)
+
+    # step 12.2, solar declination
+    declination = solar_declination(julian_day)
+
+    # step 13, latitude in radians
+    latitude_r = deg2rad(latitude)
+
+    # step 14, sunset hour angle
+    angle = sunset_hour_angle(latitude_r, declination)
+
+    # step 15, extraerrestrial radiation
+    Ra = extraterrestrial_radiation(dist, angle, latitude_r, declination)
+
+    # step 16, clear sky solar radiation
+    Rso = clear_sky_solar_radiation(elevation, Ra)
+
+    # Ra for the solar radiation estimate, see calc_solar_radiation
+    omega_pre = max(-1.0, min(1.0, -math.tan(latitude_r) * math.tan(declination)))
+    omega = math.acos(omega_pre)
+    Ra_estimate = 24.0 / math.pi * 4.92 * dist * (omega * math.sin(latitude_r) * math.sin(declination) + math.cos(latitude_r) * math.cos(declination) * math.sin(omega))
+
+    return (dist, declination, latitude_r, angle, Ra, Rso, Ra_estimate)
+
+# Called when the location changes, the old entries won't be used again
+def clear_astronomy_cache():
+    astronomy_terms.cache_clear()
+
+
 # temperature in C
 # elevation in meters
 # latitude in degrees
@@ -146,30 +201,16 @@ def evapotranspriation(max_t, min_t, solar_radiation, avg_ws, elevation, max_h,
     # step 11.1, vapor pressure deficit
     vp_deficit = vp_curve - vp_actual
 
-    # step 12.1, relative sun earth distance
-    dist = relative_earth_sun_distance(julian_day)
-
-    # step 12.2, solar declination
-    declination = solar_declination(julian_day)
-
-    # step 13, latitude in radians
-    latitude_r = deg2rad(latitude)
+    # steps 12 - 16, the sun/earth terms only depend on the location and
+    # day so they come from the astronomy table.
+    (dist, declination, latitude_r, angle, Ra, Rso, Ra_estimate) = astronomy(latitude, elevation, julian_day)
 
     ## Testing solar radiation calculation
     if solar_radiation is None:
-        Rs = calc_solar_radiation(min_t, max_t, latitude_r, declination, julian_day)
+        Rs = 0.17 * math.sqrt(max_t - min_t) * Ra_estimate
     else:
         Rs = w2mj(solar_radiation)
 
-    # step 14, sunset hour angle
-    angle = sunset_hour_angle(latitude_r, declination)
-
-    # step 15, extraerrestrial radiation
-    Ra = extraterrestrial_radiation(dist, angle, latitude_r, declination)
-
-    # step 16, clear sky solar radiation
-    Rso = clear_sky_solar_radiation(elevation, Ra)
-
     # step 17, net solar radiation
     Rns = (1 - canopy_coefficient) * Rs
 
@@ -195,6 +236,189 @@ def evapotranspriation(max_t, min_t, solar_radiation, avg_ws, elevation, max_h,
 
 
 
+"""
+    Hourly ET0 (FAO-56 equation 53) using measured solar radiation.
+
+    temperature in C, humidity in %, avg_ws in m/s, solar_radiation in
+    W/m2 (the average over the hour), elevation in meters, latitude and
+    longitude in degrees (east positive), day is the day of the year and
+    hour is the UTC hour at the start of the period.
+
+    Returns ET0 for the hour in mm.
+"""
+# Stefan-Boltzmann constant per hour, MJ K-4 m-2 hour-1
+stefanBoltzmannHourly = 2.043e-10
+# Rs/Rso ratio assumed at night when there's no clear sky radiation
+nightRadiationRatio = 0.8
+
+# seasonal correction for solar time (hours), FAO-56 equation 32
+def solar_time_correction(julian_day):
+    b = 2 * math.pi * (julian_day - 81) / 364
+    return 0.1645 * math.sin(2 * b) - 0.1255 * math.cos(b) - 0.025 * math.sin(b)
+
+def hourly_extraterrestrial_radiation(latitude_r, longitude, julian_day, hour):
+    dist = relative_earth_sun_distance(julian_day)
+    declination = solar_declination(julian_day)
+
+    Sc = solar_time_correction(julian_day)
+
+    # solar time angle at the midpoint of the hour
+    omega = math.pi / 12 * ((hour + 0.5 + longitude / 15 + Sc) - 12)
+    omega = math.atan2(math.sin(omega), math.cos(omega))
+    omega1 = omega - math.pi / 24
+    omega2 = omega + math.pi / 24
+
+    # clip to sunrise/sunset
+    omega_s = math.acos(max(-1.0, min(1.0, -math.tan(latitude_r) * math.tan(declination))))
+    omega1 = max(-omega_s, min(omega_s, omega1))
+    omega2 = max(-omega_s, min(omega_s, omega2))
+    if omega1 >= omega2:
+        return 0.0
+
+    rel1 = 12 * 60 / math.pi * solarConstant * dist
+    rel2 = (omega2 - omega1) * math.sin(latitude_r) * math.sin(declination) + math.cos(latitude_r) * math.cos(declination) * (math.sin(omega2) - math.sin(omega1))
+    return max(0.0, rel1 * rel2)
+
+def hourly_evapotranspiration(temperature, humidity, avg_ws, solar_radiation, elevation, latitude, longitude, canopy_coefficient, day, hour):
+    vp_slope = saturation_vapor_pressure_curve_slope(temperature)
+    psychrometric = psychrometric_constant(atmospheric_pressure(elevation))
+
+    vp_saturation = saturation_vapor(temperature)
+    vp_actual = vp_saturation * humidity / 100
+
+    # radiation in MJ/m2 for the hour
+    Rs = solar_radiation * 0.0036
+    Ra = hourly_extraterrestrial_radiation(deg2rad(latitude), longitude, day, hour)
+    Rso = clear_sky_solar_radiation(elevation, Ra)
+
+    if Rso > 0:
+        ratio = min(1.0, Rs / Rso)
+    else:
+        ratio = nightRadiationRatio
+
+    Rns = (1 - canopy_coefficient) * Rs
+    Rnl = stefanBoltzmannHourly * math.pow(temperature + kelvin, 4) * (0.34 - 0.14 * math.sqrt(vp_actual)) * (1.35 * ratio - 0.35)
+    Rn = Rns - Rnl
+
+    # soil heat flux, day and night
+    if Rs > 0:
+        G = 0.1 * Rn
+    else:
+        G = 0.5 * Rn
+
+    top = 0.408 * vp_slope * (Rn - G) + psychrometric * (37 / (temperature + kelvin)) * avg_ws * (vp_saturation - vp_actual)
+    bottom = vp_slope + psychrometric * (1 + 0.34 * avg_ws)
+    return top / bottom
+
+
+"""
+    Batch version of evapotranspriation().  Takes sequences (or numpy
+    arrays) of daily values for any number of days and computes all the
+    ET0 values in one vectorized pass.  elevation, latitude and
+    canopy_coefficient may be single values (one location) or sequences
+    (one per day, for many locations).  solar_radiation may be None to
+    use the temperature based estimate for every day.
+
+    The terms that only depend on the location are computed once for the
+    whole batch and the astronomy terms are computed with numpy rather
+    than looked up day by day in the astronomy table, so multi-year or
+    many location batches don't churn the table.  Returns a list of ET0
+    values in mm/day.
+
+    Without numpy this falls back to calling evapotranspriation() for
+    each day.
+"""
+def evapotranspiration_batch(max_t, min_t, solar_radiation, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day):
+    if numpy is None:
+        return evapotranspiration_loop(max_t, min_t, solar_radiation, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day)
+
+    np = numpy
+    max_t = np.asarray(max_t, dtype=float)
+    min_t = np.asarray(min_t, dtype=float)
+    avg_ws = np.asarray(avg_ws, dtype=float)
+    max_h = np.asarray(max_h, dtype=float)
+    min_h = np.asarray(min_h, dtype=float)
+    julian_day = np.asarray(day, dtype=float)
+    elevation = np.asarray(elevation, dtype=float)
+    latitude = np.asarray(latitude, dtype=float)
+    canopy_coefficient = np.asarray(canopy_coefficient, dtype=float)
+
+    # location constant terms, steps 5 and 6
+    pressure = 101.3 * np.power((293 - 0.0065 * elevation) / 293, 5.26)
+    psychrometric = 0.000665 * pressure
+
+    # step 1, mean daily air temperature C
+    mean_daily_temp = (max_t + min_t) / 2.0
+
+    # step 4, slope of saturation vapor pressure curve
+    sv_max = 0.6108 * np.exp((enthalpy * max_t) / (max_t + vaporRate))
+    sv_min = 0.6108 * np.exp((enthalpy * min_t) / (min_t + vaporRate))
+    sv_mean = 0.6108 * np.exp((enthalpy * mean_daily_temp) / (mean_daily_temp + vaporRate))
+    vp_slope = 4098 * sv_mean / np.power(mean_daily_temp + vaporRate, 2)
+
+    # step 7 & 8, delta and psi terms
+    bottom = vp_slope + psychrometric * (1 + 0.34 * avg_ws)
+    delta = vp_slope / bottom
+    psi = psychrometric / bottom
+
+    # step 9, temperature term
+    t_term = (900) / (mean_daily_temp + kelvin) * avg_ws
+
+    # step 10 & 11, mean saturation and actual vapor pressure
+    vp_curve = (sv_max + sv_min) / 2
+    vp_actual = (sv_min * (max_h / 100) + sv_max * (min_h / 100)) / 2
+
+    # steps 12 - 16 as in astronomy_terms(), computed for the whole
+    # batch with the same rounding of the location
+    latitude_r = np.radians(np.round(latitude, 3))
+    elevation = np.round(elevation, 1)
+    julian_day = np.trunc(julian_day)
+
+    # step 12, relative sun earth distance and solar declination
+    dist = 1 + 0.033 * np.cos(((2 * np.pi) / 365) * julian_day)
+    declination = 0.409 * np.sin(((2 * np.pi) / 365) * julian_day - 1.39)
+
+    # step 14, sunset hour angle
+    tan_product = -1 * np.tan(latitude_r) * np.tan(declination)
+    angle = np.arccos(tan_product)
+
+    # step 15 & 16, extraterrestrial and clear sky radiation
+    Ra = 24*60 / np.pi * solarConstant * dist * ((angle * np.sin(latitude_r) * np.sin(declination)) + (np.cos(latitude_r) * np.cos(declination) * np.sin(angle)))
+    Rso = (0.75 + (2 * math.pow(10, -5)) * elevation) * Ra
+
+    if solar_radiation is None:
+        # same estimate as calc_solar_radiation()
+        omega = np.arccos(np.clip(tan_product, -1.0, 1.0))
+        Ra_estimate = 24.0 / np.pi * 4.92 * dist * (omega * np.sin(latitude_r) * np.sin(declination) + np.cos(latitude_r) * np.cos(declination) * np.sin(omega))
+        Rs = 0.17 * np.sqrt(max_t - min_t) * Ra_estimate
+    else:
+        Rs = np.asarray(solar_radiation, dtype=float) * 0.0864
+
+    # step 17, 18 & 19, net radiation
+    Rns = (1 - canopy_coefficient) * Rs
+    Rnl = 4.903 * math.pow(10, -9) * (np.power(max_t + kelvin, 4) + np.power(min_t + kelvin, 4)) / 2 * (0.34 - 0.14 * np.sqrt(vp_actual)) * (1.35 * Rs / Rso - 0.35)
+    Rn = Rns - Rnl
+
+    # step FS1 & FS2, radiation and wind terms
+    radiation_term = delta * Rn * 0.408
+    wind_term = psi * t_term * (vp_curve - vp_actual)
+
+    return np.atleast_1d(radiation_term + wind_term).tolist()
+
+# Non-vectorized batch, used when numpy isn't available
+def evapotranspiration_loop(max_t, min_t, solar_radiation, avg_ws, elevation, max_h, min_h, latitude, canopy_coefficient, day):
+    def per_day(value, i):
+        if isinstance(value, (list, tuple)) or (numpy is not None and isinstance(value, numpy.ndarray)):
+            return value[i]
+        return value
+
+    et0 = []
+    for i in range(len(max_t)):
+        Rs = None if solar_radiation is None else per_day(solar_radiation, i)
+        et0.append(evapotranspriation(max_t[i], min_t[i], Rs, avg_ws[i], per_day(elevation, i), max_h[i], min_h[i], per_day(latitude, i), per_day(canopy_coefficient, i), day[i]))
+    return et0
+
+
 if __name__ == '__main__':
     #et0 = evapotranspriation(27.3, 10.7, 16.502, 1.3, 98.5, 36, 91, 36.82, 0.17, 289)
 
@@ -204,6 +428,24 @@ if __name__ == '__main__':
     et0 = evapotranspriation(27.3, 10.7, None, 1.3, 401.33, 91, 36, 36.82, 0.23, 289)
     print("et0 = ", et0)
 
+    # batch results should match the single day calculation
+    days = list(range(1, 366))
+    max_t = [20 + 10 * math.sin(d / 58.0) for d in days]
+    min_t = [t - 12 for t in max_t]
+    ws = [1.0 + (d % 7) * 0.3 for d in days]
+    max_h = [90 - (d % 11) for d in days]
+    min_h = [35 + (d % 13) for d in days]
+    batch = evapotranspiration_batch(max_t, min_t, None, ws, 401.33, max_h, min_h, 36.82, 0.23, days)
+    single = [evapotranspriation(max_t[i], min_t[i], None, ws[i], 401.33, max_h[i], min_h[i], 36.82, 0.23, days[i]) for i in range(len(days))]
+    error = max(abs(a - b) for (a, b) in zip(batch, single))
+    print("batch max difference = ", error)
+    assert error < 1e-9
+
+    # FAO-56 example 19, N'Diaye, Senegal 1 October 14:00-15:00 local
+    # (UTC) at 16.2N, 16.25W, 8m: expected ETo 0.63 mm/hour
+    et0 = hourly_evapotranspiration(38, 52, 3.3, 2.450 / 0.0036, 8, 16.2, -16.25, 0.23, 274, 14)
+    print("hourly et0 = ", et0)
+
 
 
 
@@ -0,0 +1,113 @@
+#
+#  Background fetch worker
+#
+#  The poll callbacks run on the polyinterface input thread, which also
+#  handles commands and queries from the ISY.  Rather than block that
+#  thread on the network, the polls just signal this worker which does
+#  the fetch and publishes the results to the nodes when it completes.
+#
+#  Only one fetch is ever in flight.  Requests made while a fetch is
+#  running are coalesced into a single follow-up fetch instead of piling
+#  up behind it.
+#
+#  Other work that publishes to the nodes (applying a configuration
+#  change) is posted to the worker too, so it never runs at the same
+#  time as a fetch.  Posted jobs run in order, before the next fetch.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import threading
+
+LOGGER = polyinterface.LOGGER
+
+
+# Combine two requests for the same data set. True means fetch it,
+# False means don't and None leaves it up to the fetch planner.
+def merge_request(a, b):
+    if a is True or b is True:
+        return True
+    if a is None or b is None:
+        return None
+    return False
+
+
+class FetchWorker(threading.Thread):
+    def __init__(self, fetch):
+        super(FetchWorker, self).__init__(name='FetchWorker')
+        self.daemon = True
+        self.fetch = fetch
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.pending = None
+        self.jobs = []
+        self.busy = False
+        self.running = True
+        self.skipped = 0
+
+    """
+        Ask for a fetch.  Returns immediately, if a fetch is already in
+        progress this request is merged with any other waiting request.
+    """
+    def request(self, conditions=None, forecast=None):
+        with self.lock:
+            if self.pending is None:
+                self.pending = (conditions, forecast)
+            else:
+                self.pending = (merge_request(self.pending[0], conditions),
+                                merge_request(self.pending[1], forecast))
+                self.skipped += 1
+
+            if self.busy:
+                LOGGER.debug('Fetch still in progress, request coalesced')
+
+            self.idle.clear()
+            self.wakeup.set()
+
+    # Run function(*args) on the worker thread, before the next fetch
+    def post(self, function, *args):
+        with self.lock:
+            self.jobs.append((function, args))
+            self.idle.clear()
+            self.wakeup.set()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait()
+
+            with self.lock:
+                self.wakeup.clear()
+                if self.pending is None and len(self.jobs) == 0:
+                    continue
+                jobs = self.jobs
+                self.jobs = []
+                request = self.pending
+                self.pending = None
+                self.busy = True
+
+            try:
+                for (function, args) in jobs:
+                    try:
+                        function(*args)
+                    except Exception as e:
+                        LOGGER.error('Fetch worker job: ' + str(e))
+                if request is not None:
+                    self.fetch(*request)
+            except Exception as e:
+                LOGGER.error('Fetch worker: ' + str(e))
+            finally:
+                with self.lock:
+                    self.busy = False
+                    if self.pending is None and len(self.jobs) == 0:
+                        self.idle.set()
+
+    # Block until there are no fetches or jobs running or waiting
+    def wait_idle(self, timeout=None):
+        return self.idle.wait(timeout)
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
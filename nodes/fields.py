@@ -0,0 +1,151 @@
+#
+#  API field to driver mapping tables
+#
+#  Each entry maps a field in the API 'values' dictionary to the driver
+#  that displays it and the precision the driver value is rounded to.
+#  The unit conversion is picked from the driver.  Adding a new field to
+#  a node is just a matter of adding an entry here (and the driver to the
+#  node definition).
+
+from nodes import uom
+
+# Realtime conditions, published on the controller node
+CONDITIONS = [
+        # (API field,               driver,    precision)
+        ('temperature',             'CLITEMP', 3),
+        ('humidity',                'CLIHUM',  3),
+        ('pressureSeaLevel',        'BARPRES', 3),
+        ('windSpeed',               'SPEED',   3),
+        ('windGust',                'GV5',     3),
+        ('windDirection',           'WINDDIR', 3),
+        ('visibility',              'DISTANC', 3),
+        ('precipitationIntensity',  'RAINRT',  3),
+        ('dewPoint',                'DEWPT',   3),
+        ('temperatureApparent',     'GV2',     3),
+        ('solarGHI',                'SOLRAD',  3),
+        ('cloudCover',              'GV14',    3),
+        ('weatherCode',             'GV13',    3),
+        ('epaIndex',                'GV17',    3),
+        ]
+
+# Daily forecast, published on the forecast nodes
+FORECAST = [
+        ('temperatureMax',          'GV0',     1),
+        ('temperatureMin',          'GV1',     1),
+        ('humidityAvg',             'CLIHUM',  0),
+        ('pressureSeaLevelMax',     'BARPRES', 1),
+        ('precipitationIntensity',  'RAINRT',  3),
+        ('windSpeedMax',            'GV7',     1),
+        ('windSpeedMin',            'GV8',     1),
+        ('precipitationProbability', 'GV18',   1),
+        ('weatherCode',             'GV13',    3),
+        ]
+
+# Refresh tiers, the longest time (seconds) a field's value may go
+# without being requested again.  'fast' fields are requested every time
+# their timeline is fetched, the others only when they're due.  Fields
+# that aren't requested keep their previous values (see carry_over).
+TIERS = {
+        'fast':   0,
+        'medium': 1800,
+        'slow':   3 * 3600,
+        'daily':  86400,
+        }
+
+# Fields requested for each timeline and their refresh tier
+REQUEST = {
+        # realtime (5m)
+        '5m': [
+            ('precipitationIntensity',  'fast'),
+            ('precipitationType',       'fast'),
+            ('temperature',             'fast'),
+            ('temperatureApparent',     'fast'),
+            ('windSpeed',               'fast'),
+            ('windGust',                'fast'),
+            ('windDirection',           'fast'),
+            ('solarGHI',                'fast'),
+            ('weatherCode',             'fast'),
+            ('dewPoint',                'medium'),
+            ('humidity',                'medium'),
+            ('pressureSeaLevel',        'medium'),
+            ('cloudCover',              'medium'),
+            ('visibility',              'slow'),
+            ('cloudCeiling',            'slow'),
+            ('cloudBase',               'slow'),
+            ('epaIndex',                'slow'),
+            ],
+        # daily forecast (1d)
+        '1d': [
+            ('precipitationIntensity',  'fast'),
+            ('precipitationType',       'fast'),
+            ('precipitationProbability', 'fast'),
+            ('temperatureMin',          'fast'),
+            ('temperatureMax',          'fast'),
+            ('temperatureApparent',     'fast'),
+            ('dewPoint',                'fast'),
+            ('windSpeedMin',            'fast'),
+            ('windSpeedMax',            'fast'),
+            ('windSpeedAvg',            'fast'),
+            ('windGust',                'fast'),
+            ('humidityMin',             'fast'),
+            ('humidityMax',             'fast'),
+            ('humidityAvg',             'fast'),
+            ('weatherCode',             'fast'),
+            ('pressureSeaLevelMin',     'medium'),
+            ('pressureSeaLevelMax',     'medium'),
+            ('windDirection',           'medium'),
+            ('cloudCover',              'medium'),
+            ('solarGHI',                'medium'),
+            ('visibility',              'slow'),
+            ('cloudCeiling',            'slow'),
+            ('cloudBase',               'slow'),
+            ],
+        }
+
+
+"""
+    The fields of a timeline that are due at time now.  fetched maps
+    (timestep, tier) to the time that tier was last requested.  margin
+    lets a tier be picked up a little early, see the fetch planner.
+    Returns (fields, tiers).
+"""
+def due_fields(timestep, fetched, now, margin=0):
+    request = []
+    tiers = set()
+    for (field, tier) in REQUEST[timestep]:
+        if now - fetched.get((timestep, tier), 0) >= TIERS[tier] - margin:
+            request.append(field)
+            tiers.add(tier)
+    return (request, tiers)
+
+"""
+    Fill in the fields that weren't requested this time from the previous
+    intervals of the same timeline, matched by start time.  Intervals
+    past the end of the previous data use its last interval.
+"""
+def carry_over(old, new):
+    if not old:
+        return
+    by_time = {}
+    for interval in old:
+        by_time[interval['startTime']] = interval['values']
+    latest = old[-1]['values']
+
+    for interval in new:
+        values = interval['values']
+        for (field, value) in by_time.get(interval['startTime'], latest).items():
+            if field not in values:
+                values[field] = value
+
+
+"""
+    Compile a mapping table for the given units.  The result is a list of
+    (field, driver, converter, precision) where converter is None when
+    the value is used as is.  This is done once when the units are set so
+    publishing values is a simple loop.
+"""
+def compile_mapping(table, units):
+    mapping = []
+    for (field, driver, prec) in table:
+        mapping.append((field, driver, uom.converter(driver, units), prec))
+    return mapping
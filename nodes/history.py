@@ -0,0 +1,232 @@
+#
+#  Observation history
+#
+#  Fixed size ring buffers of the realtime values for the last 24 hours,
+#  one slot per 5 minutes, with the rolling statistics kept up to date
+#  as values are added:
+#
+#   - rainfall over the last 24 hours, integrated from the
+#     precipitation intensity (the v4 API has no accumulation field)
+#   - temperature high and low over the last 24 hours
+#   - pressure change over the last 3 hours
+#
+#  Values are stored in array('d') buffers, empty slots are NaN.  The
+#  buffers are saved in the response cache as base64 encoded bytes.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import base64
+import collections
+import math
+from array import array
+from nodes import nowcast
+
+LOGGER = polyinterface.LOGGER
+
+STEP = 300               # seconds per slot
+SLOTS = 288              # 24 hours of slots
+MAX_GAP = 900            # longest gap (seconds) rain is integrated over
+TENDENCY = 3 * 3600      # pressure tendency period (seconds)
+NAN = float('nan')
+
+
+"""
+    Ring buffer of one value per slot.  head is the slot number (time
+    divided by the step) of the newest slot, the buffer covers the size
+    slots up to and including head.  The sum and count of the slot values
+    and the min/max (monotonic deques of (slot, value)) are updated as
+    values come and go so none of the statistics have to look at the
+    whole buffer.
+"""
+class Ring:
+    def __init__(self, size=SLOTS, step=STEP):
+        self.size = size
+        self.step = step
+        self.clear()
+
+    def clear(self):
+        self.values = array('d', [NAN]) * self.size
+        self.head = None
+        self.total = 0.0
+        self.count = 0
+        self.low = collections.deque()
+        self.high = collections.deque()
+
+    """
+        Move the head forward to slot, emptying the slots that drop out
+        of the window.  Returns False for a slot that's older than the
+        head.
+    """
+    def advance(self, slot):
+        if self.head is None or slot - self.head >= self.size:
+            self.clear()
+            self.head = slot
+            return True
+        if slot < self.head:
+            return False
+
+        for s in range(self.head + 1, slot + 1):
+            self.remove(s % self.size)
+        self.head = slot
+
+        oldest = slot - self.size
+        while self.low and self.low[0][0] <= oldest:
+            self.low.popleft()
+        while self.high and self.high[0][0] <= oldest:
+            self.high.popleft()
+        return True
+
+    def remove(self, index):
+        old = self.values[index]
+        if not math.isnan(old):
+            self.total -= old
+            self.count -= 1
+            self.values[index] = NAN
+
+    def store(self, slot, value):
+        self.remove(slot % self.size)
+        self.values[slot % self.size] = value
+        self.total += value
+        self.count += 1
+
+        # A value replaced within the slot stays in the deques until
+        # the slot drops out, so min and max cover every value set.
+        while self.low and self.low[-1][1] >= value:
+            self.low.pop()
+        self.low.append((slot, value))
+        while self.high and self.high[-1][1] <= value:
+            self.high.pop()
+        self.high.append((slot, value))
+
+    # Set the value for the slot time t falls in
+    def set(self, t, value):
+        slot = int(t // self.step)
+        if self.advance(slot):
+            self.store(slot, value)
+
+    # Add to the value for the slot time t falls in
+    def add(self, t, amount):
+        slot = int(t // self.step)
+        if self.advance(slot):
+            old = self.values[slot % self.size]
+            self.store(slot, amount if math.isnan(old) else old + amount)
+
+    def sum(self):
+        return self.total if self.count > 0 else None
+
+    def min(self):
+        return self.low[0][1] if self.low else None
+
+    def max(self):
+        return self.high[0][1] if self.high else None
+
+    # Value for a slot number or None if the slot is empty
+    def value_at(self, slot):
+        if self.head is None or slot > self.head or slot <= self.head - self.size:
+            return None
+        value = self.values[slot % self.size]
+        return None if math.isnan(value) else value
+
+    def latest(self):
+        if self.head is None:
+            return None
+        return self.value_at(self.head)
+
+    def save(self):
+        return {
+                'head': self.head,
+                'values': base64.b64encode(self.values.tobytes()).decode('ascii'),
+                }
+
+    def load(self, data):
+        values = array('d')
+        values.frombytes(base64.b64decode(data['values']))
+        if len(values) != self.size:
+            raise ValueError('expected {} slots, got {}'.format(self.size, len(values)))
+
+        self.clear()
+        if data['head'] is None:
+            return
+        self.head = int(data['head'])
+        for slot in range(self.head - self.size + 1, self.head + 1):
+            value = values[slot % self.size]
+            if not math.isnan(value):
+                self.store(slot, value)
+
+
+class History:
+    def __init__(self):
+        self.temperature = Ring()
+        self.pressure = Ring()
+        self.rain = Ring()
+        self.last_rain = None     # (time, intensity) of the previous sample
+
+    """
+        Add a set of realtime values observed at time now.  The rain that
+        fell since the previous values is estimated from the previous
+        intensity.
+    """
+    def add(self, now, values):
+        temperature = values.get('temperature')
+        if nowcast.is_number(temperature):
+            self.temperature.set(now, temperature)
+
+        pressure = values.get('pressureSeaLevel')
+        if nowcast.is_number(pressure):
+            self.pressure.set(now, pressure)
+
+        intensity = values.get('precipitationIntensity')
+        if nowcast.is_number(intensity):
+            if self.last_rain is not None and now > self.last_rain[0]:
+                elapsed = min(now - self.last_rain[0], MAX_GAP)
+                self.rain.add(now, self.last_rain[1] * elapsed / 3600)
+            self.last_rain = (now, intensity)
+
+    # Rainfall (mm) over the last 24 hours
+    def rain_24h(self):
+        total = self.rain.sum()
+        if total is None:
+            return None
+        return max(0.0, total)
+
+    def temperature_high(self):
+        return self.temperature.max()
+
+    def temperature_low(self):
+        return self.temperature.min()
+
+    """
+        Pressure change (hPa) over the last 3 hours or None when there
+        isn't a value from around 3 hours ago yet.
+    """
+    def pressure_tendency(self):
+        current = self.pressure.latest()
+        if current is None:
+            return None
+
+        past = self.pressure.head - TENDENCY // self.pressure.step
+        for slot in (past, past - 1, past + 1, past - 2, past + 2):
+            value = self.pressure.value_at(slot)
+            if value is not None:
+                return current - value
+        return None
+
+    def save(self):
+        return {
+                'temperature': self.temperature.save(),
+                'pressure': self.pressure.save(),
+                'rain': self.rain.save(),
+                'last_rain': self.last_rain,
+                }
+
+    def load(self, data):
+        try:
+            self.temperature.load(data['temperature'])
+            self.pressure.load(data['pressure'])
+            self.rain.load(data['rain'])
+            self.last_rain = data['last_rain']
+        except Exception as e:
+            LOGGER.warning('Ignoring saved history: ' + str(e))
+            self.__init__()
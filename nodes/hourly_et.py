@@ -0,0 +1,115 @@
+#
+#  Hourly evapotranspiration accumulator
+#
+#  Keeps the ETo for each hour of the 1h timeline so that daily totals
+#  can be built from the hourly values.  Each hour is only calculated
+#  when it first shows up or when its forecast values change so each
+#  update only does the new hours.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import time
+from nodes import api
+from nodes import et3
+
+LOGGER = polyinterface.LOGGER
+
+# Fields needed from the 1h timeline
+FIELDS = ['temperature', 'humidity', 'windSpeed', 'solarGHI']
+
+# How long to remember hours that have passed (seconds)
+KEEP = 2 * 86400
+
+
+class HourlyET:
+    def __init__(self):
+        # hour start (epoch seconds) -> [input values, ETo mm]
+        self.hours = {}
+
+    def clear(self):
+        self.hours = {}
+
+    """
+        Add the intervals from a 1h timeline.  Returns the number of hours
+        that had to be calculated.
+    """
+    def update(self, intervals, latitude, longitude, elevation, plant_type):
+        calculated = 0
+        for interval in intervals:
+            try:
+                start = api.parse_time(interval['startTime'])
+                start -= start % 3600
+                values = interval['values']
+                inputs = [values[f] for f in FIELDS]
+                if start in self.hours and self.hours[start][0] == inputs:
+                    continue
+
+                et0 = calculate(start, inputs, latitude, longitude, elevation, plant_type)
+                self.hours[start] = [inputs, et0]
+                calculated += 1
+            except Exception as e:
+                LOGGER.error('Hourly ETo for {}: {}'.format(interval.get('startTime'), e))
+
+        # forget hours we no longer need
+        oldest = time.time() - KEEP
+        for start in [h for h in self.hours if h < oldest]:
+            del self.hours[start]
+
+        LOGGER.debug('Hourly ETo: calculated {} of {} hours'.format(calculated, len(intervals)))
+        return calculated
+
+    # Calculate every hour again from the saved inputs, for when the
+    # location's elevation or the plant type changes
+    def recalculate(self, latitude, longitude, elevation, plant_type):
+        for (start, hour) in self.hours.items():
+            try:
+                hour[1] = calculate(start, hour[0], latitude, longitude, elevation, plant_type)
+            except Exception as e:
+                LOGGER.error('Hourly ETo for {}: {}'.format(time.ctime(start), e))
+
+    """
+        Total ETo for the period [start, end).  If complete is True and any
+        hour in the period is missing, None is returned.  The hour
+        containing 'end' is pro-rated.
+    """
+    def total(self, start, end, complete=False):
+        total = 0.0
+        hour = start - (start % 3600)
+        while hour < end:
+            if hour in self.hours:
+                et0 = self.hours[hour][1]
+                if hour + 3600 > end:
+                    et0 = et0 * (end - hour) / 3600
+                total += et0
+            elif complete:
+                return None
+            hour += 3600
+        return total
+
+    # ETo from local midnight until now
+    def today(self, now=None):
+        if now is None:
+            now = time.time()
+        t = time.localtime(now)
+        midnight = time.mktime((t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0, 0, 0, -1))
+        return self.total(midnight, now)
+
+    # For saving in the response cache
+    def save(self):
+        return [[start, h[0], h[1]] for (start, h) in self.hours.items()]
+
+    def load(self, data):
+        self.hours = {}
+        for (start, inputs, et0) in data:
+            self.hours[start] = [inputs, et0]
+
+
+# ETo (mm) for the hour starting at start, inputs are the FIELDS values
+def calculate(start, inputs, latitude, longitude, elevation, plant_type):
+    (temperature, humidity, wind_speed, solar_radiation) = inputs
+    t = time.gmtime(start)
+    return et3.hourly_evapotranspiration(temperature, humidity, wind_speed,
+            solar_radiation, elevation, latitude, longitude, plant_type,
+            t.tm_yday, t.tm_hour)
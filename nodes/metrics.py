@@ -0,0 +1,180 @@
+#
+#  Poll metrics
+#
+#  Counters, gauges and latency histograms for the stages of a poll
+#  (fetch, parse, publish, cache) and the API calls, kept in memory.
+#  A few headline numbers are shown as controller drivers and the full
+#  set can be written to a file in the Prometheus text format, for the
+#  node exporter's textfile collector.
+#
+#  Everything is keyed by metric name and a sorted tuple of label
+#  (name, value) pairs.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import collections
+import contextlib
+import os
+import threading
+import time
+
+LOGGER = polyinterface.LOGGER
+
+PREFIX = 'climacell_'
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WRITE_INTERVAL = 60      # seconds between writes of the metrics file
+
+# name: (type, help)
+DESCRIPTIONS = {
+        'stage_seconds': ('histogram', 'Time spent in each stage of a poll'),
+        'api_calls_total': ('counter', 'API calls made, by response status'),
+        'api_errors_total': ('counter', 'API calls that failed or returned no data'),
+        'api_response_bytes_total': ('counter', 'Bytes received from the API'),
+        'api_last_latency_seconds': ('gauge', 'Duration of the last API call'),
+        'api_last_response_bytes': ('gauge', 'Size of the last API response'),
+        'api_calls_last_hour': ('gauge', 'API calls made in the last hour'),
+        'api_quota_remaining': ('gauge', 'Remaining API quota reported by the API'),
+        'breaker_open': ('gauge', '1 while the API circuit breaker is open'),
+        'polls_total': ('counter', 'Polls received from Polyglot'),
+        'driver_updates_total': ('counter', 'Driver values sent to Polyglot'),
+        'driver_updates_skipped_total': ('counter', 'Driver updates not sent because the value did not change enough'),
+        }
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for (i, bound) in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.calls = collections.deque()     # times of the API calls
+        self.last_latency = None
+        self.errors = 0
+        self.written = 0
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    # Time a block of code as a stage of the poll
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage)
+
+    """
+        Record an API call.  status is the HTTP status or 'error' when
+        there was no response.
+    """
+    def api_call(self, seconds, status, size=0, now=None):
+        if now is None:
+            now = time.time()
+        self.inc('api_calls_total', status=str(status))
+        self.observe('stage_seconds', seconds, stage='fetch')
+        self.set('api_last_latency_seconds', seconds)
+        if size:
+            self.inc('api_response_bytes_total', size)
+            self.set('api_last_response_bytes', size)
+        with self.lock:
+            self.last_latency = seconds
+            self.calls.append(now)
+
+    def api_error(self):
+        self.inc('api_errors_total')
+        with self.lock:
+            self.errors += 1
+
+    def calls_last_hour(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            while self.calls and now - self.calls[0] >= 3600:
+                self.calls.popleft()
+            return len(self.calls)
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            families = collections.defaultdict(list)
+            for (key, value) in self.counters.items():
+                families[key[0]].append((key[1], value))
+            for (key, value) in self.gauges.items():
+                families[key[0]].append((key[1], value))
+            for (key, value) in self.histograms.items():
+                families[key[0]].append((key[1], value))
+
+            for name in sorted(families):
+                (kind, text) = DESCRIPTIONS.get(name, ('untyped', name))
+                lines.append('# HELP {}{} {}'.format(PREFIX, name, text))
+                lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+                for (labels, value) in sorted(families[name], key=lambda f: f[0]):
+                    if isinstance(value, Histogram):
+                        cumulative = 0
+                        for (bound, count) in zip(value.buckets, value.counts):
+                            cumulative += count
+                            lines.append(sample(name + '_bucket', labels + (('le', repr(bound)),), cumulative))
+                        lines.append(sample(name + '_bucket', labels + (('le', '+Inf'),), value.count))
+                        lines.append(sample(name + '_sum', labels, value.sum))
+                        lines.append(sample(name + '_count', labels, value.count))
+                    else:
+                        lines.append(sample(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+    # Write the metrics file, at most every WRITE_INTERVAL seconds
+    def write(self, path, now=None, force=False):
+        if now is None:
+            now = time.time()
+        if not path or (not force and now - self.written < WRITE_INTERVAL):
+            return
+        self.written = now
+
+        # the textfile collector may read at any time, never leave it a
+        # partial file
+        tmp = path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(self.prometheus())
+            os.replace(tmp, path)
+        except Exception as e:
+            LOGGER.error('Failed to write metrics: ' + str(e))
+
+
+def sample(name, labels, value):
+    if labels:
+        text = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for (k, v) in labels)
+        return '{}{}{{{}}} {}'.format(PREFIX, name, text, value)
+    return '{}{} {}'.format(PREFIX, name, value)
@@ -0,0 +1,97 @@
+#
+#  Nowcast replay
+#
+#  The realtime (5m) timeline covers the next few hours.  The whole
+#  series is kept and on each shortPoll the values for the current time
+#  are published from it, so the API only has to be queried again when
+#  the series gets old or runs out.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import bisect
+from nodes import api
+
+LOGGER = polyinterface.LOGGER
+
+# Fields that can't be interpolated, the value of the current interval
+# is used as is.
+CATEGORICAL = ('weatherCode', 'precipitationType')
+
+# Fields in degrees that wrap around at 360
+CIRCULAR = ('windDirection',)
+
+# Interval length assumed when the series has a single interval
+DEFAULT_STEP = 300
+
+
+class Nowcast:
+    def __init__(self):
+        self.series = ([], [])   # (start times, values)
+
+    def __len__(self):
+        return len(self.series[0])
+
+    def clear(self):
+        self.series = ([], [])
+
+    # Replace the series with the intervals from a 5m timeline
+    def set(self, intervals):
+        times = []
+        values = []
+        for interval in intervals:
+            try:
+                times.append(api.parse_time(interval['startTime']))
+                values.append(interval['values'])
+            except Exception as e:
+                LOGGER.error('Bad nowcast interval {}: {}'.format(interval, e))
+                return
+        # swap in the new series in one step, it's read from other threads
+        self.series = (times, values)
+
+    # Seconds of data left in the series after now
+    def horizon(self, now):
+        (times, values) = self.series
+        if len(times) == 0:
+            return 0
+        step = times[-1] - times[-2] if len(times) > 1 else DEFAULT_STEP
+        return times[-1] + step - now
+
+    """
+        Values for the time now.  With interpolate the values are
+        linearly interpolated between the intervals on either side of
+        now, otherwise the values of the interval now falls in are used.
+        Returns None when there's no data.
+    """
+    def at(self, now, interpolate=True):
+        (times, values) = self.series
+        if len(times) == 0:
+            return None
+
+        i = bisect.bisect_right(times, now) - 1
+        if i < 0:
+            return values[0]
+        if not interpolate or i >= len(times) - 1:
+            return values[i]
+
+        fraction = (now - times[i]) / (times[i + 1] - times[i])
+        return blend(values[i], values[i + 1], fraction)
+
+
+def blend(first, second, fraction):
+    values = {}
+    for (field, a) in first.items():
+        b = second.get(field)
+        if field in CATEGORICAL or not is_number(a) or not is_number(b):
+            values[field] = a
+        elif field in CIRCULAR:
+            # go the short way around
+            diff = ((b - a + 180) % 360) - 180
+            values[field] = (a + diff * fraction) % 360
+        else:
+            values[field] = a + (b - a) * fraction
+    return values
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
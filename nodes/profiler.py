@@ -0,0 +1,198 @@
+#
+#  Poll profiler
+#
+#  Opt-in profiling of the next few poll cycles of a running node
+#  server, switched on by the PROFILE command or the 'Profile Polls'
+#  parameter.  While it's on:
+#
+#   - the fetch thread runs each poll cycle under cProfile, and
+#   - a sampler thread takes the stacks of every busy thread (the fetch
+#     thread and the location query pool) every few milliseconds.
+#
+#  When the cycles are done three files are written to the log
+#  directory: the cProfile stats sorted by cumulative and own time
+#  (.txt), the raw stats for other tools (.prof) and the sampled stacks
+#  in the collapsed format flamegraph.pl and speedscope read (.folded).
+#
+#  When it's off the only cost is checking the active flag once per
+#  poll.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import collections
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+LOGGER = polyinterface.LOGGER
+
+LOG_DIR = './logs'            # polyinterface's log directory
+SAMPLE_INTERVAL = 0.005       # seconds between stack samples
+MAX_POLLS = 100
+STATS_LINES = 60
+
+# Innermost frames of a thread that's waiting for work
+IDLE = {
+        'threading.py': ('wait', '_wait_for_tstate_lock'),
+        'queue.py': ('get',),
+        'thread.py': ('_worker',),
+        }
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only stacks that run node server code are sampled, not Polyglot's MQTT
+# thread or anything else in the process
+OWN = (os.path.join(ROOT, 'nodes') + os.sep, os.path.join(ROOT, 'node_funcs.py'))
+
+
+"""
+    Thread that samples the stacks of the other threads while a poll
+    cycle is running and counts them by collapsed stack.
+"""
+class Sampler(threading.Thread):
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super(Sampler, self).__init__(name='Sampler')
+        self.daemon = True
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.busy = threading.Event()
+        self.stopping = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopping.is_set():
+            if not self.busy.wait(0.5):
+                continue
+            self.sample(own)
+            time.sleep(self.interval)
+
+    def sample(self, own):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        self.samples += 1
+        for (ident, frame) in sys._current_frames().items():
+            if ident == own or is_idle(frame):
+                continue
+            stack = []
+            own_code = False
+            while frame is not None:
+                own_code = own_code or frame.f_code.co_filename.startswith(OWN)
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if own_code:
+                stack.append(names.get(ident, 'thread-{}'.format(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopping.set()
+        self.busy.set()
+
+def is_idle(frame):
+    names = IDLE.get(os.path.basename(frame.f_code.co_filename))
+    return names is not None and frame.f_code.co_name in names
+
+def frame_label(frame):
+    filename = frame.f_code.co_filename
+    if filename.startswith(ROOT):
+        filename = os.path.relpath(filename, ROOT)
+    else:
+        filename = os.path.basename(filename)
+    return '{} ({}:{})'.format(frame.f_code.co_name, filename, frame.f_code.co_firstlineno)
+
+
+class PollProfiler:
+    def __init__(self, directory=LOG_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.active = False
+        self.running = False
+        self.remaining = 0
+
+    """
+        Profile the next polls poll cycles.  A session already running is
+        extended to polls more cycles, 0 ends it.
+    """
+    def start(self, polls):
+        polls = min(int(polls), MAX_POLLS)
+        with self.lock:
+            if polls <= 0:
+                if self.active:
+                    self.remaining = 0
+                    if not self.running:
+                        self.finish()
+                return
+            self.remaining = polls
+            if self.active:
+                LOGGER.warning('Profiling extended to the next {} polls'.format(polls))
+                return
+            self.profile = cProfile.Profile()
+            self.sampler = Sampler()
+            self.sampler.start()
+            self.polls = 0
+            self.elapsed = 0.0
+            self.started = time.time()
+            self.active = True
+        LOGGER.warning('Profiling the next {} polls'.format(polls))
+
+    # Run one poll cycle under the profiler.  A profile can only follow
+    # one thread, a cycle started while another is profiled just runs.
+    def run(self, function, *args):
+        with self.lock:
+            if not self.active or self.remaining <= 0 or self.running:
+                return function(*args)
+            self.running = True
+
+        self.sampler.busy.set()
+        start = time.perf_counter()
+        try:
+            return self.profile.runcall(function, *args)
+        finally:
+            self.elapsed += time.perf_counter() - start
+            self.sampler.busy.clear()
+            with self.lock:
+                self.running = False
+                self.polls += 1
+                self.remaining -= 1
+                if self.remaining <= 0:
+                    self.finish()
+
+    # Write the results and switch off, with the lock held
+    def finish(self):
+        self.active = False
+        self.sampler.stop()
+        if self.polls == 0:
+            LOGGER.warning('Profiling stopped before any polls ran')
+            return
+
+        base = os.path.join(self.directory, time.strftime('profile-%Y%m%d-%H%M%S', time.localtime(self.started)))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            n = 1
+            name = base
+            while os.path.exists(base + '.txt'):
+                n += 1
+                base = '{}-{}'.format(name, n)
+            self.profile.dump_stats(base + '.prof')
+            with open(base + '.txt', 'w') as f:
+                f.write(self.report())
+            with open(base + '.folded', 'w') as f:
+                for (stack, count) in sorted(self.sampler.stacks.items()):
+                    f.write('{} {}\n'.format(stack, count))
+            LOGGER.warning('Profiled {} polls ({:.3f} s), results in {}.txt, .prof and .folded'.format(self.polls, self.elapsed, base))
+        except Exception as e:
+            LOGGER.error('Failed to write profile: ' + str(e))
+
+    def report(self):
+        out = io.StringIO()
+        out.write('{} polls, {:.3f} s in polls, {} stack samples every {} ms\n\n'.format(
+            self.polls, self.elapsed, self.sampler.samples, int(self.sampler.interval * 1000)))
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.strip_dirs()
+        for order in ('cumulative', 'tottime'):
+            out.write('Sorted by {}\n'.format(order))
+            stats.sort_stats(order).print_stats(STATS_LINES)
+        return out.getvalue()
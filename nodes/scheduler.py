@@ -0,0 +1,256 @@
+#
+#  Quota aware poll scheduler
+#
+#  shortPoll and longPoll only provide the tick, this decides how often
+#  each location's data is actually fetched.
+#
+#   - A token bucket limits the calls per hour.  The rate is the
+#     'Hourly Quota' parameter or, if that isn't set, the limit the API
+#     reports in its X-RateLimit-Limit-Hour header.
+#   - The remaining hourly/daily quota reported by the API is tracked
+#     and the poll intervals are stretched when the quota won't last at
+#     the planned call rate.
+#   - When the weather is changing quickly (precipitation starting, fast
+#     pressure drop) a location's intervals are tightened back to the
+#     configured poll intervals and the forecast is fetched twice as
+#     often.
+#   - Rate limited (429) and server error (5xx) responses back off
+#     exponentially before trying again.
+#
+#  The bucket and back off state are saved in the node server's custom
+#  data so a restart doesn't hand out a fresh burst of calls.
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import threading
+import time
+
+LOGGER = polyinterface.LOGGER
+
+MAX_STRETCH = 8          # never stretch intervals more than this
+BURST = 5                # token bucket capacity
+BACKOFF_MIN = 60         # seconds
+BACKOFF_MAX = 3600       # seconds
+VOLATILE_HOLD = 3600     # seconds to stay tightened after volatility
+PRESSURE_DROP = 1.0      # hPa per hour considered a fast drop
+PRESSURE_WINDOW = 1800   # seconds, minimum span for the pressure trend
+SAVE_INTERVAL = 3600     # seconds between routine saves of the state
+SAVE_QUOTA_STEP = 0.1    # fraction of the limit the remaining quota has to move
+
+
+class Scheduler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rate = 0                     # calls per hour, 0 is no limit
+        self.configured_rate = 0
+        self.tokens = BURST
+        self.token_time = time.time()
+        self.limit = {'hour': None, 'day': None}
+        self.remaining = {'hour': None, 'day': None}
+        self.backoff = 0
+        self.backoff_until = 0
+
+    # rate from the 'Hourly Quota' parameter, 0 means use the API's limit
+    def set_rate(self, calls_per_hour):
+        with self.lock:
+            self.configured_rate = calls_per_hour
+            self.rate = calls_per_hour if calls_per_hour > 0 else (self.limit['hour'] or 0)
+
+    def refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(BURST, self.tokens + (now - self.token_time) * self.rate / 3600)
+        else:
+            self.tokens = BURST
+        self.token_time = now
+
+    """
+        Take a token for an API call.  Returns False if the call should
+        not be made now, because we're backing off or out of tokens.
+    """
+    def take(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if now < self.backoff_until:
+                return False
+            self.refill(now)
+            if self.tokens < 1:
+                LOGGER.info('Hourly quota used up, skipping query')
+                return False
+            self.tokens -= 1
+            return True
+
+    def backing_off(self, now=None):
+        if now is None:
+            now = time.time()
+        return now < self.backoff_until
+
+    """
+        Record the result of an API call.  headers is the response
+        header dictionary (case insensitive with requests).
+    """
+    def record(self, status, headers, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            for period in ('hour', 'day'):
+                limit = header_int(headers, 'X-RateLimit-Limit-' + period)
+                remaining = header_int(headers, 'X-RateLimit-Remaining-' + period)
+                if limit is not None:
+                    self.limit[period] = limit
+                if remaining is not None:
+                    self.remaining[period] = remaining
+
+            if self.configured_rate == 0 and self.limit['hour']:
+                self.rate = self.limit['hour']
+
+            if status == 429 or status >= 500:
+                self.backoff = min(BACKOFF_MAX, max(BACKOFF_MIN, self.backoff * 2))
+                retry = header_int(headers, 'Retry-After')
+                delay = max(self.backoff, retry or 0)
+                self.backoff_until = now + delay
+                LOGGER.warning('API returned {}, backing off for {} seconds'.format(status, delay))
+            elif status < 400:
+                self.backoff = 0
+                self.backoff_until = 0
+
+            if status == 429:
+                # whatever the headers say, we're out right now
+                self.tokens = 0
+
+    """
+        How much to stretch the poll intervals so the remaining quota
+        lasts at the planned call rate (calls per hour).  1 means no
+        stretching.
+    """
+    def stretch(self, planned_rate, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            allowed = []
+            if self.rate > 0:
+                allowed.append(self.rate)
+            if self.remaining['hour'] is not None:
+                left = 3600 - (now % 3600)
+                allowed.append(self.remaining['hour'] * 3600 / max(left, 60))
+            if self.remaining['day'] is not None:
+                left = 86400 - (now % 86400)
+                allowed.append(self.remaining['day'] * 3600 / max(left, 3600))
+
+        if len(allowed) == 0 or planned_rate <= 0:
+            return 1.0
+        budget = min(allowed)
+        if budget <= 0:
+            return MAX_STRETCH
+        return min(MAX_STRETCH, max(1.0, planned_rate / budget))
+
+    # state saved in custom data
+    def save(self):
+        with self.lock:
+            return {
+                    'tokens': round(self.tokens, 3),
+                    'time': int(self.token_time),
+                    'backoff': self.backoff,
+                    'until': int(self.backoff_until),
+                    'limit': dict(self.limit),
+                    'remaining': dict(self.remaining),
+                    }
+
+    """
+        Whether the state is materially different from a saved state: the
+        back off or the limits changed or the remaining quota moved by
+        SAVE_QUOTA_STEP of the limit.  Small changes to the token and
+        quota counts happen with every call and are left for the routine
+        save.
+    """
+    def changed_since(self, saved):
+        if not isinstance(saved, dict):
+            return True
+        state = self.save()
+        for key in ('backoff', 'until', 'limit'):
+            if state[key] != saved.get(key):
+                return True
+        remaining = saved.get('remaining') or {}
+        for period in ('hour', 'day'):
+            old = remaining.get(period)
+            new = state['remaining'][period]
+            if old is None or new is None:
+                if old != new:
+                    return True
+            elif abs(new - old) >= max(1, SAVE_QUOTA_STEP * (state['limit'][period] or 0)):
+                return True
+        return False
+
+    def load(self, data):
+        if not isinstance(data, dict):
+            return
+        with self.lock:
+            try:
+                self.tokens = float(data['tokens'])
+                self.token_time = float(data['time'])
+                self.backoff = int(data['backoff'])
+                self.backoff_until = float(data['until'])
+                self.limit.update(data.get('limit', {}))
+                self.remaining.update(data.get('remaining', {}))
+            except Exception as e:
+                LOGGER.warning('Ignoring saved scheduler state: ' + str(e))
+
+
+def header_int(headers, name):
+    try:
+        return int(headers[name])
+    except:
+        return None
+
+"""
+    Look for fast changing weather: precipitation starting since the
+    previous values or pressure falling faster than PRESSURE_DROP hPa per
+    hour.  pressure_ref is a (time, pressure) sample at least
+    PRESSURE_WINDOW seconds old so that small changes between polls
+    aren't mistaken for a trend.
+"""
+def is_volatile(previous, values, pressure_ref, now):
+    try:
+        if previous is not None and (previous.get('precipitationIntensity') or 0) == 0 and (values.get('precipitationIntensity') or 0) > 0:
+            return True
+    except TypeError:
+        pass
+
+    try:
+        if pressure_ref is not None and 'pressureSeaLevel' in values:
+            elapsed = now - pressure_ref[0]
+            if elapsed >= PRESSURE_WINDOW:
+                drop = (pressure_ref[1] - values['pressureSeaLevel']) * 3600 / elapsed
+                if drop >= PRESSURE_DROP:
+                    return True
+    except TypeError:
+        pass
+
+    return False
+
+
+if __name__ == '__main__':
+    # a saved state must not follow later changes to the scheduler (the
+    # response headers are case insensitive, a plain dict isn't)
+    scheduler = Scheduler()
+    now = time.time()
+    scheduler.record(200, {'X-RateLimit-Limit-hour': '100', 'X-RateLimit-Remaining-hour': '100'}, now)
+    saved = scheduler.save()
+    assert not scheduler.changed_since(saved)
+    scheduler.record(200, {'X-RateLimit-Remaining-hour': '5'}, now)
+    print('remaining 100 -> 5 changed = ', scheduler.changed_since(saved))
+    assert scheduler.changed_since(saved)
+    saved = scheduler.save()
+    scheduler.record(200, {'X-RateLimit-Limit-hour': '1000'}, now)
+    print('limit 100 -> 1000 changed = ', scheduler.changed_since(saved))
+    assert scheduler.changed_since(saved)
+
+    # small moves of the remaining quota are left for the routine save
+    saved = scheduler.save()
+    scheduler.record(200, {'X-RateLimit-Remaining-hour': '4'}, now)
+    assert not scheduler.changed_since(saved)
+    scheduler.record(503, {}, now)
+    print('back off changed = ', scheduler.changed_since(saved))
+    assert scheduler.changed_since(saved)
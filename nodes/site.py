@@ -0,0 +1,125 @@
+#
+#  Weather locations
+#
+#  The primary location comes from the Latitude/Longitude parameters and
+#  its current conditions are shown on the controller node.  Additional
+#  locations listed in the 'Locations' parameter each get their own
+#  conditions node.  Every location has its own set of forecast nodes and
+#  keeps its own fetch state so the locations can be fetched
+#  independently (and concurrently).
+
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+from nodes import history
+from nodes import hourly_et
+from nodes import nowcast
+from nodes import scheduler
+
+LOGGER = polyinterface.LOGGER
+
+MAX_LOCATIONS = 20
+
+
+class Site:
+    def __init__(self, key, name, latitude, longitude, elevation, conditions_address):
+        self.key = key          # '' for the primary location, s1, s2, ...
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+        self.conditions_address = conditions_address
+        self.fetch_time = {'conditions': 0, 'forecast': 0}
+        self.tier_time = {}     # (timestep, tier) -> last requested
+        self.timelines = {}     # timestep -> last intervals received
+        self.shown = {}         # forecast address -> (startTime, fingerprint)
+        self.hourly = hourly_et.HourlyET()
+        self.nowcast = nowcast.Nowcast()
+        self.history = history.History()
+        self.previous = None
+        self.pressure_ref = None
+        self.volatile_until = 0
+
+    def is_primary(self):
+        return self.key == ''
+
+    def location(self):
+        return '{},{}'.format(self.latitude, self.longitude)
+
+    def forecast_address(self, day):
+        if self.is_primary():
+            return 'forecast_' + str(day)
+        return self.key + '_f' + str(day)
+
+    def forecast_name(self, day):
+        if self.is_primary():
+            return 'Forecast ' + str(day)
+        return self.name + ' Forecast ' + str(day)
+
+    # Check new realtime values for fast changing weather
+    def check_volatility(self, values, now):
+        if scheduler.is_volatile(self.previous, values, self.pressure_ref, now):
+            if not self.volatile(now):
+                LOGGER.info('Weather is changing quickly at ' + self.name)
+            self.volatile_until = now + scheduler.VOLATILE_HOLD
+
+        self.previous = values
+        if 'pressureSeaLevel' in values:
+            if self.pressure_ref is None or now - self.pressure_ref[0] >= 2 * scheduler.PRESSURE_WINDOW:
+                self.pressure_ref = (now, values['pressureSeaLevel'])
+
+    def volatile(self, now):
+        return now < self.volatile_until
+
+    # Key for this location's entries in the response cache
+    def cache_key(self, kind):
+        if self.is_primary():
+            return kind
+        return self.key + '_' + kind
+
+
+"""
+    Parse the 'Locations' parameter.  It's a list of locations separated
+    by semicolons, each one is
+
+        name:latitude,longitude[,elevation]
+
+    for example "Home:38.99,-121.44;Cabin:39.1,-120.2,1900". Locations
+    without an elevation use default_elevation.  Returns a list of
+    (name, latitude, longitude, elevation) tuples, invalid entries are
+    logged and skipped.
+"""
+def parse_locations(value, default_elevation):
+    locations = []
+    if value is None:
+        return locations
+
+    for entry in value.split(';'):
+        entry = entry.strip()
+        if entry == '':
+            continue
+
+        try:
+            if ':' in entry:
+                (name, coordinates) = entry.split(':', 1)
+                name = name.strip()
+            else:
+                name = 'Location ' + str(len(locations) + 1)
+                coordinates = entry
+
+            parts = [float(p) for p in coordinates.split(',')]
+            if len(parts) < 2 or len(parts) > 3:
+                raise ValueError('expected latitude,longitude[,elevation]')
+            if not (-90 <= parts[0] <= 90 and -180 <= parts[1] <= 180):
+                raise ValueError('latitude/longitude out of range')
+            elevation = parts[2] if len(parts) == 3 else default_elevation
+            locations.append((name, parts[0], parts[1], elevation))
+        except Exception as e:
+            LOGGER.error('Invalid location "{}": {}'.format(entry, e))
+
+        if len(locations) >= MAX_LOCATIONS:
+            LOGGER.warning('Only the first {} locations are used'.format(MAX_LOCATIONS))
+            break
+
+    return locations
@@ -47,6 +47,15 @@ def get_uom(units):
             'GV18': 22,     # chance of precipitation
             'GV19': 25,     # day of week
             'GV20': 106,    # ETo
+            'GV21': 117,    # pressure tendency
+            'GV22': 20,     # sunrise
+            'GV23': 20,     # sunset
+            'GV24': 20,     # day length
+            'GV25': 14,     # solar elevation
+            'GV26': 45,     # data age
+            'GV27': 42,     # last API latency
+            'GV28': 56,     # API calls last hour
+            'GV29': 56,     # API errors
         }
     elif unit_cfg == 'uk':
         uom = {
@@ -81,6 +90,15 @@ def get_uom(units):
             'GV18': 22,     # chance of precipitation
             'GV19': 25,     # day of week
             'GV20': 120,    # ETo
+            'GV21': 117,    # pressure tendency
+            'GV22': 20,     # sunrise
+            'GV23': 20,     # sunset
+            'GV24': 20,     # day length
+            'GV25': 14,     # solar elevation
+            'GV26': 45,     # data age
+            'GV27': 42,     # last API latency
+            'GV28': 56,     # API calls last hour
+            'GV29': 56,     # API errors
         }
     else:
         uom = {
@@ -115,6 +133,15 @@ def get_uom(units):
             'GV18': 22,     # chance of precipitation
             'GV19': 25,     # day of week
             'GV20': 120,    # ETo
+            'GV21': 23,     # pressure tendency
+            'GV22': 20,     # sunrise
+            'GV23': 20,     # sunset
+            'GV24': 20,     # day length
+            'GV25': 14,     # solar elevation
+            'GV26': 45,     # data age
+            'GV27': 42,     # last API latency
+            'GV28': 56,     # API calls last hour
+            'GV29': 56,     # API errors
         }
 
     return uom
@@ -136,63 +163,108 @@ def hpa2hgin(pressure, u):
     return round(pressure * 0.02953, 3)
 
 def mmh2inh(rain, u):
-    return round(rain * 0.393701, 3)
+    return round(rain * 0.0393701, 3)
 
 def ms2mph(speed, u):
     return round(speed * 2.23694, 1)
 
 def mm2in(rain, u):
-    return round(rain * 0.393701, 3)
+    return round(rain * 0.0393701, 3)
 
 def km2mile(distance, u):
     return round(distance * .621371, 1)
 
+# Conversion function for each driver, drivers mapped to None are
+# never converted.
+FUNCTION_MAP = {
+        'ST': None,   # node server status
+        'CLITEMP': c2f,   # temperature
+        'CLIHUM': None,   # humidity
+        'BARPRES': hpa2hgin, # pressure
+        'WINDDIR': None,  # direction
+        'DEWPT': c2f,     # dew point
+        'SOLRAD': None,   # solar radiation
+        'RAINRT': mmh2inh,   # rain rate
+        'GV0': c2f,       # max temp
+        'GV1': c2f,       # min temp
+        'GV2': c2f,       # ??feels like
+        'GV3': c2f,       # heat index  
+        'GV4': c2f,       # wind chill
+        'SPEED': ms2mph,    # wind speed
+        'GV5': ms2mph,      # wind gusts
+        'GV6': mm2in,      # rain
+        'GV7': ms2mph,      # wind max
+        'GV8': ms2mph,      # wind min  
+        'GV9': None,      # moon phase
+        'GV10': None,     # ozone
+        'GV11': None,     # climate coverage
+        'GV12': None,     # climate intensity
+        'GV13': None,     # climate conditions
+        'GV14': None,     # cloud conditions
+        'GV15': mm2in,     # snow depth
+        'DISTANC': km2mile,  # visibility (kilometers)
+        'UV': None,       # UV index
+        'GV17': None,     # Air Quality
+        'GV18': None,     # chance of precipitation
+        'GV19': None,     # day of week
+        'GV20': mm2in,    # ETo
+        'GV21': hpa2hgin, # pressure tendency
+        'GV22': None,     # sunrise
+        'GV23': None,     # sunset
+        'GV24': None,     # day length
+        'GV25': None,     # solar elevation
+        'GV26': None,     # data age
+        'GV27': None,     # API latency
+        'GV28': None,     # API calls
+        'GV29': None,     # API errors
+}
+
+def is_metric(unit_cfg):
+    return unit_cfg == 'metric' or unit_cfg == 'si' or unit_cfg.startswith('m')
+
 # convert the value based on the driver.  Incoming units are
 # assumed to be metric.
 def conversion(driver, units, value):
+    convert = converter(driver, units)
+    if convert is None:
+        return value
+
+    return convert(value)
+
+"""
+    Return a function that converts a metric value for the driver to
+    the requested units or None if no conversion is needed.  Used to
+    build the field mapping tables once instead of looking up the
+    conversion for every value.
+"""
+def converter(driver, units):
     unit_cfg = units.lower()
 
-    function_map = {
-            'ST': None,   # node server status
-            'CLITEMP': c2f,   # temperature
-            'CLIHUM': None,   # humidity
-            'BARPRES': hpa2hgin, # pressure
-            'WINDDIR': None,  # direction
-            'DEWPT': c2f,     # dew point
-            'SOLRAD': None,   # solar radiation
-            'RAINRT': mmh2inh,   # rain rate
-            'GV0': c2f,       # max temp
-            'GV1': c2f,       # min temp
-            'GV2': c2f,       # ??feels like
-            'GV3': c2f,       # heat index  
-            'GV4': c2f,       # wind chill
-            'SPEED': ms2mph,    # wind speed
-            'GV5': ms2mph,      # wind gusts
-            'GV6': mm2in,      # rain
-            'GV7': ms2mph,      # wind max
-            'GV8': ms2mph,      # wind min  
-            'GV9': None,      # moon phase
-            'GV10': None,     # ozone
-            'GV11': None,     # climate coverage
-            'GV12': None,     # climate intensity
-            'GV13': None,     # climate conditions
-            'GV14': None,     # cloud conditions
-            'GV15': mm2in,     # snow depth
-            'DISTANC': km2mile,  # visibility (kilometers)
-            'UV': None,       # UV index
-            'GV17': None,     # Air Quality
-            'GV18': None,     # chance of precipitation
-            'GV19': None,     # day of week
-            'GV20': mm2in,    # ETo
-    }
-
-    if driver not in function_map:
-        return value
+    if is_metric(unit_cfg):
+        return None
 
-    if function_map[driver] == None:
-        return value
+    function = FUNCTION_MAP.get(driver)
+    if function is None:
+        return None
+
+    return lambda value: function(value, unit_cfg)
 
-    if unit_cfg == 'metric' or unit_cfg == 'si' or unit_cfg.startswith('m'):
-        return value
 
-    return function_map[driver](value, unit_cfg)
+if __name__ == '__main__':
+    # conversions of known metric values for the us and uk unit systems
+    checks = (
+            ('CLITEMP', 'us', 20, 68.0),
+            ('CLITEMP', 'uk', 20, 20),
+            ('BARPRES', 'us', 1013.25, 29.921),
+            ('RAINRT', 'us', 25.4, 1.0),
+            ('GV6', 'us', 25.4, 1.0),       # rain last 24 hours
+            ('GV6', 'uk', 12.7, 0.5),
+            ('GV20', 'us', 0.375, 0.015),   # ETo so far today
+            ('SPEED', 'us', 10, 22.4),
+            ('DISTANC', 'uk', 10, 6.2),
+            ('GV6', 'metric', 25.4, 25.4),
+            )
+    for (driver, units, value, expected) in checks:
+        result = conversion(driver, units, value)
+        print('{} {} {} = {}'.format(driver, units, value, result))
+        assert abs(result - expected) < 1e-9, '{} {}: expected {}'.format(driver, units, expected)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Climacell v4 timelines API.
+
+Serves /v4/timelines from the JSON fixtures in tools/fixtures so the node
+server can be run, measured and load tested without an API key or
+network.  Point the node server at it with the 'API URL' parameter, for
+example http://127.0.0.1:8080
+
+The fixture time stamps are moved to the current time, only the
+requested timesteps and fields are returned and endTime is honoured.
+
+Scenarios (--scenario or /control?scenario=...):
+    ok          normal responses
+    error       every request fails with 500
+    ratelimit   every request fails with 429 and a Retry-After header
+    timeout     requests hang for --hang seconds before answering
+    flaky       --failure-rate of the requests fail with 503
+    invalid     responses are not valid JSON
+
+Other run time controls: /control?latency=<ms>&jitter=<ms>&intervals=<n>
+/stats returns the request counts.
+
+Copyright (C) 2021 Robert Paauwe
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+STEPS = {'5m': 300, '15m': 900, '30m': 1800, '1h': 3600, '1d': 86400}
+SCENARIOS = ('ok', 'error', 'ratelimit', 'timeout', 'flaky', 'invalid')
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+class State:
+    def __init__(self, args):
+        self.lock = threading.Lock()
+        self.scenario = args.scenario
+        self.latency = args.latency
+        self.jitter = args.jitter
+        self.failure_rate = args.failure_rate
+        self.hang = args.hang
+        self.intervals = args.intervals
+        self.limit_hour = args.limit_hour
+        self.limit_day = args.limit_day
+        self.enforce = args.enforce_limits
+        self.calls = []           # times of the accepted calls
+        self.stats = {'requests': 0, 'ok': 0, 'failed': 0, 'bytes': 0}
+        self.timelines = load_fixtures(FIXTURES)
+
+    def settings(self):
+        return {
+                'scenario': self.scenario,
+                'latency': self.latency,
+                'jitter': self.jitter,
+                'failure_rate': self.failure_rate,
+                'hang': self.hang,
+                'intervals': self.intervals,
+                'limit_hour': self.limit_hour,
+                'limit_day': self.limit_day,
+                'enforce_limits': self.enforce,
+                }
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    # Count a call and return the remaining (hour, day) quota
+    def count_call(self, now):
+        with self.lock:
+            self.calls = [t for t in self.calls if now - t < 86400]
+            self.calls.append(now)
+            hour = len([t for t in self.calls if now - t < 3600])
+            return (self.limit_hour - hour, self.limit_day - len(self.calls))
+
+
+# Load every timeline from the fixture files, by timestep
+def load_fixtures(directory):
+    timelines = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            data = json.load(f)
+        for timeline in data['data']['timelines']:
+            timelines[timeline['timestep']] = timeline
+    return timelines
+
+def parse_time(timestamp):
+    return datetime.datetime.strptime(timestamp, TIME_FORMAT)
+
+"""
+    Move a fixture timeline to the current time.  Sub-daily timelines
+    start at the current step, daily timelines keep their time of day so
+    the days still line up with the fixture's local midnight.
+"""
+def current_timeline(timeline, now, count=None, fields=None, end_time=None):
+    step = STEPS[timeline['timestep']]
+    intervals = timeline['intervals']
+    first = parse_time(intervals[0]['startTime'])
+
+    if step >= 86400:
+        start = now.replace(hour=first.hour, minute=first.minute, second=0, microsecond=0)
+        if start > now:
+            start -= datetime.timedelta(days=1)
+    else:
+        seconds = (now.hour * 3600 + now.minute * 60 + now.second) // step * step
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(seconds=seconds)
+
+    if count is None:
+        count = len(intervals)
+
+    result = []
+    for i in range(count):
+        t = start + datetime.timedelta(seconds=step * i)
+        if end_time is not None and t > end_time:
+            break
+        values = intervals[i % len(intervals)]['values']
+        if fields is not None:
+            values = {k: v for (k, v) in values.items() if k in fields}
+        else:
+            values = copy.copy(values)
+        result.append({'startTime': t.strftime(TIME_FORMAT), 'values': values})
+
+    return {
+            'timestep': timeline['timestep'],
+            'startTime': result[0]['startTime'] if result else start.strftime(TIME_FORMAT),
+            'endTime': result[-1]['startTime'] if result else start.strftime(TIME_FORMAT),
+            'intervals': result,
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # the headers and body are written separately, without this a kept
+    # alive connection waits on delayed ACKs for every response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_json(self, status, body, headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+        return len(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/v4/timelines':
+            self.timelines(query)
+        elif url.path == '/control':
+            self.control(query)
+        elif url.path == '/stats':
+            state = self.server.state
+            with state.lock:
+                stats = dict(state.stats)
+            self.send_json(200, dict(stats, settings=state.settings()))
+        else:
+            self.send_json(404, {'code': 404001, 'type': 'Not Found', 'message': 'unknown path'})
+
+    def control(self, query):
+        state = self.server.state
+        with state.lock:
+            for (name, convert) in (('latency', float), ('jitter', float),
+                    ('failure_rate', float), ('hang', float),
+                    ('intervals', int), ('limit_hour', int), ('limit_day', int)):
+                if name in query:
+                    setattr(state, name, convert(query[name][0]))
+            if 'scenario' in query:
+                if query['scenario'][0] not in SCENARIOS:
+                    self.send_json(400, {'message': 'unknown scenario'})
+                    return
+                state.scenario = query['scenario'][0]
+        self.send_json(200, state.settings())
+
+    def timelines(self, query):
+        state = self.server.state
+        state.count('requests')
+
+        delay = state.latency + random.uniform(0, state.jitter)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        if 'apikey' not in self.headers and 'apikey' not in query:
+            state.count('failed')
+            self.send_json(401, {'code': 401001, 'type': 'Invalid Auth', 'message': 'The method requires authentication but it was not presented or is invalid.'})
+            return
+
+        (remaining_hour, remaining_day) = state.count_call(time.time())
+        headers = {
+                'X-RateLimit-Limit-Hour': state.limit_hour,
+                'X-RateLimit-Remaining-Hour': max(0, remaining_hour),
+                'X-RateLimit-Limit-Day': state.limit_day,
+                'X-RateLimit-Remaining-Day': max(0, remaining_day),
+                }
+
+        scenario = state.scenario
+        if scenario == 'flaky' and random.random() < state.failure_rate:
+            scenario = 'error'
+        if state.enforce and (remaining_hour < 0 or remaining_day < 0):
+            scenario = 'ratelimit'
+
+        if scenario == 'timeout':
+            time.sleep(state.hang)
+        elif scenario == 'error':
+            state.count('failed')
+            self.send_json(503 if state.scenario == 'flaky' else 500, {'code': 500000, 'type': 'Internal Server Error', 'message': 'stand-in failure'}, headers)
+            return
+        elif scenario == 'ratelimit':
+            state.count('failed')
+            headers['Retry-After'] = 60
+            self.send_json(429, {'code': 429001, 'type': 'Too Many Calls', 'message': 'The request limit for this resource has been reached.'}, headers)
+            return
+        elif scenario == 'invalid':
+            state.count('failed')
+            self.send_json(200, b'{"data": {"timelines": [', headers)
+            return
+
+        try:
+            timesteps = query['timesteps'][0].split(',')
+            fields = set(query['fields'][0].split(','))
+            end_time = parse_time(query['endTime'][0]) if 'endTime' in query else None
+        except Exception as e:
+            state.count('failed')
+            self.send_json(400, {'code': 400001, 'type': 'Invalid Body Parameters', 'message': str(e)}, headers)
+            return
+
+        now = datetime.datetime.utcfromtimestamp(time.time())
+        timelines = []
+        for timestep in timesteps:
+            if timestep not in state.timelines:
+                state.count('failed')
+                self.send_json(400, {'code': 400001, 'type': 'Invalid Body Parameters', 'message': 'no fixture for timestep ' + timestep}, headers)
+                return
+            timelines.append(current_timeline(state.timelines[timestep], now, state.intervals or None, fields, end_time))
+
+        state.count('ok')
+        state.count('bytes', self.send_json(200, {'data': {'timelines': timelines}}, headers))
+
+
+def make_server(args):
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    server.state = State(args)
+    server.verbose = args.verbose
+    return server
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the Climacell v4 timelines API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--scenario', choices=SCENARIOS, default='ok')
+    parser.add_argument('--latency', type=float, default=0, help='added latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra latency, up to this many milliseconds')
+    parser.add_argument('--failure-rate', type=float, default=0.2, help='fraction of failed requests in the flaky scenario')
+    parser.add_argument('--hang', type=float, default=60, help='seconds a request hangs in the timeout scenario')
+    parser.add_argument('--intervals', type=int, default=0, help='intervals per timeline, fixtures are repeated as needed (default: as recorded)')
+    parser.add_argument('--limit-hour', type=int, default=25)
+    parser.add_argument('--limit-day', type=int, default=500)
+    parser.add_argument('--enforce-limits', action='store_true', help='answer 429 once the hourly or daily limit is used up')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = make_server(args)
+    print('Serving the Climacell stand-in on http://{}:{} ({})'.format(args.host, args.port, args.scenario))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,397 @@
+"""
+In-process stand-in for polyinterface.
+
+Provides the parts of the polyinterface API the node server uses
+(Interface, Controller, Node and LOGGER) without MQTT or a running
+Polyglot, so the real Controller can be driven from a script.  Put this
+directory first on sys.path before importing the node server modules.
+
+Everything the node server sends to Polyglot is recorded by the
+Interface with the (possibly simulated) time it was sent.  The node
+list and driver values are kept in the Interface's config the way
+Polyglot would keep them, so a restart can be simulated by building a
+new Controller from the same Interface.
+
+Copyright (C) 2021 Robert Paauwe
+"""
+
+import collections
+import logging
+import queue
+import threading
+import time
+from copy import deepcopy
+
+LOGGER = logging.getLogger('polyinterface')
+
+
+class Interface(object):
+    def __init__(self, envVar=None, config=None, keep=None):
+        self.name = envVar
+        self.profileNum = 0
+        self.connected = True
+        self.inQueue = queue.Queue()
+        self.config = {
+                'customParams': {},
+                'customData': {},
+                'notices': {},
+                'nodes': [],
+                'shortPoll': 120,
+                'longPoll': 600,
+                'isyVersion': '5.0.16',
+                }
+        if config is not None:
+            self.config.update(deepcopy(config))
+        # (time, message) of everything sent, keep limits how many are
+        # held, the counts cover everything
+        self.messages = collections.deque(maxlen=keep)
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self._configObservers = []
+        self._stopObservers = []
+
+    def onConfig(self, callback):
+        self._configObservers.append(callback)
+
+    def onStop(self, callback):
+        self._stopObservers.append(callback)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        for watcher in self._stopObservers:
+            watcher()
+
+    """
+        Deliver a config to the node server, as Polyglot does at start up
+        and when the custom parameters are changed.
+    """
+    def inConfig(self, config):
+        self.config = config
+        for watcher in self._configObservers:
+            watcher(config)
+
+    def send(self, message):
+        with self.lock:
+            for kind in message:
+                self.counts[kind] += 1
+            self.messages.append((time.time(), message))
+
+        if 'status' in message:
+            status = message['status']
+            node = self.getNode(status['address'])
+            if node:
+                for driver in node['drivers']:
+                    if driver['driver'] == status['driver']:
+                        driver['value'] = status['value']
+                        driver['uom'] = status['uom']
+
+    def addNode(self, node):
+        message = {
+            'addnode': {
+                'nodes': [{
+                    'address': node.address,
+                    'name': node.name,
+                    'node_def_id': node.id,
+                    'primary': node.primary,
+                    'drivers': node.drivers,
+                    'hint': node.hint
+                }]
+            }
+        }
+        self.send(deepcopy(message))
+
+        entry = self.getNode(node.address)
+        if not entry:
+            entry = {'address': node.address, 'isprimary': node.address == node.primary,
+                     'enabled': True, 'added': True, 'timeAdded': int(time.time())}
+            self.config['nodes'].append(entry)
+        entry['name'] = node.name
+        entry['node_def_id'] = node.id
+        entry['primary'] = node.primary
+        entry['drivers'] = deepcopy(node.drivers)
+
+    def delNode(self, address):
+        self.send({'removenode': {'address': address}})
+        self.config['nodes'] = [n for n in self.config['nodes'] if n['address'] != address]
+
+    def getNode(self, address):
+        for node in self.config['nodes']:
+            if node['address'] == address:
+                return node
+        return False
+
+    def saveCustomData(self, data):
+        self.send({'customdata': deepcopy(data)})
+        self.config['customData'] = deepcopy(data)
+
+    def saveCustomParams(self, data):
+        self.send({'customparams': deepcopy(data)})
+        self.config['customParams'] = deepcopy(data)
+
+    def addNotice(self, data):
+        self.send({'addnotice': data})
+        self.config['notices'][data['key']] = data['value']
+
+    def removeNotice(self, data):
+        self.send({'removenotice': data})
+        self.config['notices'].pop(data['key'], None)
+
+    def restart(self):
+        self.send({'restart': {}})
+
+    def installprofile(self):
+        self.send({'installprofile': {'reboot': False}})
+
+    def supports_feature(self, feature):
+        return False
+
+    # Recorded messages of one kind ('status', 'addnode', ...)
+    def sent(self, kind):
+        return [(t, m[kind]) for (t, m) in self.messages if kind in m]
+
+
+class Node(object):
+    def __init__(self, controller, primary, address, name):
+        self.controller = controller
+        self.parent = self.controller
+        self.primary = primary
+        self.address = address
+        self.name = name
+        self.polyConfig = None
+        self.drivers = deepcopy(self.drivers)
+        self._drivers = deepcopy(self.drivers)
+        self.isPrimary = None
+        self.config = None
+        self.timeAdded = None
+        self.enabled = None
+        self.added = None
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        for d in self.drivers:
+            if d['driver'] == driver:
+                d['value'] = value
+                if uom is not None:
+                    d['uom'] = uom
+                if report:
+                    self.reportDriver(d, report, force)
+                break
+
+    def reportDriver(self, driver, report, force):
+        for d in self._drivers:
+            if (d['driver'] == driver['driver'] and
+                (str(d['value']) != str(driver['value']) or
+                    d['uom'] != driver['uom'] or
+                    force)):
+                d['value'] = deepcopy(driver['value'])
+                if d['uom'] != driver['uom']:
+                    d['uom'] = deepcopy(driver['uom'])
+                self.controller.poly.send({
+                    'status': {
+                        'address': self.address,
+                        'driver': driver['driver'],
+                        'value': str(driver['value']),
+                        'uom': driver['uom']
+                    }
+                })
+                break
+
+    def reportCmd(self, command, value=None, uom=None):
+        message = {'command': {'address': self.address, 'command': command}}
+        if value is not None and uom is not None:
+            message['command']['value'] = str(value)
+            message['command']['uom'] = uom
+        self.controller.poly.send(message)
+
+    def reportDrivers(self):
+        self.updateDrivers(self.drivers)
+        for driver in self.drivers:
+            self.controller.poly.send({
+                'status': {
+                    'address': self.address,
+                    'driver': driver['driver'],
+                    'value': driver['value'],
+                    'uom': driver['uom']
+                }
+            })
+
+    def updateDrivers(self, drivers):
+        self._drivers = deepcopy(drivers)
+
+    def query(self):
+        self.reportDrivers()
+
+    def status(self):
+        self.reportDrivers()
+
+    def runCmd(self, command):
+        if command['cmd'] in self.commands:
+            fun = self.commands[command['cmd']]
+            fun(self, command)
+
+    def start(self):
+        pass
+
+    def getDriver(self, dv):
+        node = self.controller.poly.getNode(self.address)
+        if node:
+            for driver in node['drivers']:
+                if driver['driver'] == dv:
+                    return driver['value']
+        return None
+
+    id = ''
+    commands = {}
+    drivers = []
+    sends = {}
+    hint = [0, 0, 0, 0]
+
+
+"""
+    Controller without the input and node server threads.  Nodes are
+    started as soon as they're added, as if Polyglot had answered.  The
+    script driving it delivers the config with Interface.inConfig() and
+    then calls start(), the polls and commands directly.
+"""
+class Controller(Node):
+    def __init__(self, poly, name='Controller'):
+        self.controller = self
+        self.parent = self.controller
+        self.poly = poly
+        self.poly.onConfig(self._gotConfig)
+        self.poly.onStop(self.stop)
+        self.name = name
+        self.address = 'controller'
+        self.primary = self.address
+        self._drivers = deepcopy(self.drivers)
+        self._nodes = {}
+        self.config = None
+        self.nodes = {self.address: self}
+        self.polyConfig = None
+        self.isPrimary = None
+        self.timeAdded = None
+        self.enabled = None
+        self.added = None
+        self.started = False
+        self.nodesAdding = []
+
+    def _gotConfig(self, config):
+        self.polyConfig = config
+        for node in config['nodes']:
+            self._nodes[node['address']] = node
+            if node['address'] in self.nodes:
+                n = self.nodes[node['address']]
+                n.updateDrivers(node['drivers'])
+                n.config = node
+        if self.address not in self._nodes:
+            self.addNode(self)
+        if not self.started:
+            self.nodes[self.address] = self
+            self.started = True
+
+    def addNode(self, node, update=False):
+        if node.address in self._nodes:
+            node._drivers = deepcopy(self._nodes[node.address]['drivers'])
+            for driver in node.drivers:
+                for existing in self._nodes[node.address]['drivers']:
+                    if driver['driver'] == existing['driver']:
+                        driver['value'] = existing['value']
+        self.nodes[node.address] = node
+        self.poly.addNode(node)
+        if node.address != self.address:
+            node.start()
+        return node
+
+    def updateNode(self, node):
+        self.nodes[node.address] = node
+        self.poly.addNode(node)
+
+    def delNode(self, address):
+        if address in self.nodes:
+            del self.nodes[address]
+        self.poly.delNode(address)
+
+    # Handle one message from Polyglot (shortPoll, longPoll, command, query)
+    def input(self, message):
+        for key in message:
+            if key == 'command':
+                node = self.nodes.get(message[key]['address'])
+                if node is not None:
+                    node.runCmd(message[key])
+            elif key == 'shortPoll':
+                self.shortPoll()
+            elif key == 'longPoll':
+                self.longPoll()
+            elif key == 'query':
+                if message[key]['address'] in self.nodes:
+                    self.nodes[message[key]['address']].query()
+                elif message[key]['address'] == 'all':
+                    self.query()
+
+    def longPoll(self):
+        pass
+
+    def shortPoll(self):
+        pass
+
+    def query(self):
+        for node in list(self.nodes.values()):
+            node.reportDrivers()
+
+    def status(self):
+        self.query()
+
+    def runForever(self):
+        pass
+
+    def start(self):
+        pass
+
+    def saveCustomData(self, data):
+        if not isinstance(data, dict):
+            LOGGER.error('saveCustomData: data isn\'t a dictionary. Ignoring.')
+        else:
+            self.poly.saveCustomData(data)
+
+    def addCustomParam(self, data):
+        if not isinstance(data, dict):
+            LOGGER.error('addCustomParam: data isn\'t a dictionary. Ignoring.')
+        else:
+            newData = self.poly.config['customParams']
+            newData.update(data)
+            self.poly.saveCustomParams(newData)
+
+    def removeCustomParam(self, data):
+        newData = deepcopy(self.poly.config['customParams'])
+        newData.pop(data, None)
+        self.poly.saveCustomParams(newData)
+
+    def getCustomParam(self, data):
+        return self.poly.config['customParams'].get(data)
+
+    def addNotice(self, data, key=None):
+        if not isinstance(data, dict):
+            self.poly.addNotice({'key': key, 'value': data})
+        elif 'value' in data:
+            self.poly.addNotice(data)
+        else:
+            for key, value in data.items():
+                self.poly.addNotice({'key': key, 'value': value})
+
+    def removeNotice(self, key):
+        self.poly.removeNotice({'key': str(key)})
+
+    def getNotices(self):
+        return self.poly.config['notices']
+
+    def removeNoticesAll(self):
+        for key in list(self.poly.config['notices'].keys()):
+            self.removeNotice(key)
+
+    def stop(self):
+        pass
+
+    id = 'controller'
+    commands = {}
+    drivers = [{'driver': 'ST', 'value': 0, 'uom': 2}]
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Headless node server runner.
+
+Runs the real Controller against the in-process polyinterface stand-in
+(tools/harness) and the local API stand-in (tools/fake_api.py) for a
+number of simulated hours.  The clock is simulated: time.time() is
+replaced with a clock that jumps from one poll to the next, so a day of
+polling takes seconds.  Each poll cycle (the short and/or long polls due
+at that time, for every node server) is measured for CPU time, wall
+time, messages sent to Polyglot and API calls.
+
+    python3 tools/headless.py --hours 24
+    python3 tools/headless.py --hours 6 --servers 200 --json run.json
+    python3 tools/headless.py --param 'Forecast Days=7' --param 'ET Mode=hourly'
+
+The CPU time is for the whole process, so it includes the API stand-in
+when it runs in-process.  Use --api-url to point at a stand-in (or the
+real API) running elsewhere; the simulated clock then only applies to
+the node server.
+
+Copyright (C) 2021 Robert Paauwe
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TOOLS, 'harness'))
+sys.path.insert(1, os.path.dirname(TOOLS))
+
+import polyinterface
+import fake_api
+from nodes import climacell
+
+DEFAULT_PARAMS = {
+        'APIKey': 'headless',
+        'Latitude': '38.9',
+        'Longitude': '-121.4',
+        'Elevation': '100',
+        'Forecast Days': '3',
+        'Units': 'us',
+        }
+
+
+class SimClock:
+    def __init__(self, start):
+        self.now = float(start)
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(p / 100 * len(ordered))) - 1)]
+
+def stats(values):
+    if not values:
+        return {'mean': 0, 'p50': 0, 'p95': 0, 'max': 0}
+    return {
+            'mean': sum(values) / len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'max': max(values),
+            }
+
+def start_api(args):
+    api_args = ['--port', '0', '--scenario', args.scenario, '--latency', str(args.latency)]
+    if args.intervals:
+        api_args += ['--intervals', str(args.intervals)]
+    server = fake_api.make_server(fake_api.parse_args(api_args))
+    threading.Thread(target=server.serve_forever, name='FakeAPI', daemon=True).start()
+    return server
+
+def make_servers(args, api_url, workdir):
+    params = dict(DEFAULT_PARAMS)
+    for p in args.param:
+        (name, value) = p.split('=', 1)
+        params[name.strip()] = value.strip()
+    params['API URL'] = api_url
+
+    servers = []
+    for i in range(args.servers):
+        poly = polyinterface.Interface('climacell', {
+                    'customParams': dict(params),
+                    'shortPoll': args.short_poll,
+                    'longPoll': args.long_poll,
+                    }, keep=args.keep)
+        control = climacell.Controller(poly)
+        control.cache.path = os.path.join(workdir, 'cache_{}.json'.format(i))
+        servers.append(control)
+    return servers
+
+def message_count(servers, kind=None):
+    if kind is None:
+        return sum(sum(c.poly.counts.values()) for c in servers)
+    return sum(c.poly.counts[kind] for c in servers)
+
+def wait_idle(servers, timeout):
+    for c in servers:
+        if not c.fetcher.wait_idle(timeout):
+            logging.warning('{} still fetching after {} seconds'.format(c.poly.name, timeout))
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='climacell-headless-')
+    clock = SimClock(time.time())
+    real_time = time.time
+    time.time = clock.time
+
+    api_server = None
+    try:
+        if args.api_url:
+            api_url = args.api_url
+        else:
+            api_server = start_api(args)
+            api_url = 'http://127.0.0.1:{}'.format(api_server.server_address[1])
+
+        if args.tracemalloc:
+            tracemalloc.start()
+
+        startup = time.perf_counter()
+        servers = make_servers(args, api_url, workdir)
+        for c in servers:
+            c.poly.inConfig(c.poly.config)
+            c.start()
+        wait_idle(servers, args.timeout)
+        startup = time.perf_counter() - startup
+
+        step = math.gcd(args.short_poll, args.long_poll)
+        cycles = []
+        elapsed = 0
+        while elapsed < args.hours * 3600:
+            clock.advance(step)
+            elapsed += step
+            polls = []
+            if elapsed % args.short_poll == 0:
+                polls.append('shortPoll')
+            if elapsed % args.long_poll == 0:
+                polls.append('longPoll')
+            if not polls:
+                continue
+
+            messages = message_count(servers)
+            status = message_count(servers, 'status')
+            calls = api_server.state.stats['requests'] if api_server else 0
+            cpu = time.process_time()
+            wall = time.perf_counter()
+
+            for c in servers:
+                for poll in polls:
+                    c.input({poll: {}})
+            wait_idle(servers, args.timeout)
+
+            cycle = {
+                    'time': elapsed,
+                    'polls': polls,
+                    'cpu_ms': (time.process_time() - cpu) * 1000,
+                    'wall_ms': (time.perf_counter() - wall) * 1000,
+                    'messages': message_count(servers) - messages,
+                    'status': message_count(servers, 'status') - status,
+                    'api_calls': (api_server.state.stats['requests'] - calls) if api_server else None,
+                    }
+            if args.tracemalloc:
+                cycle['traced_kb'] = tracemalloc.get_traced_memory()[0] / 1024
+            cycles.append(cycle)
+
+        kinds = {}
+        for c in servers:
+            for (kind, count) in c.poly.counts.items():
+                kinds[kind] = kinds.get(kind, 0) + count
+
+        summary = {
+                'servers': args.servers,
+                'hours': args.hours,
+                'cycles': len(cycles),
+                'startup_s': startup,
+                'cpu_ms': stats([c['cpu_ms'] for c in cycles]),
+                'wall_ms': stats([c['wall_ms'] for c in cycles]),
+                'messages_per_cycle': stats([c['messages'] for c in cycles]),
+                'messages': kinds,
+                'api_calls': api_server.state.stats['requests'] if api_server else None,
+                'api_failed': api_server.state.stats['failed'] if api_server else None,
+                'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                }
+        if args.tracemalloc:
+            summary['traced_peak_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+
+        for c in servers:
+            c.stop()
+    finally:
+        time.time = real_time
+        if api_server is not None:
+            api_server.shutdown()
+
+    return {'settings': vars(args), 'summary': summary, 'cycles': cycles}
+
+def print_summary(summary):
+    print('{} node server(s), {} simulated hours, {} poll cycles, start up {:.2f} s'.format(
+        summary['servers'], summary['hours'], summary['cycles'], summary['startup_s']))
+    for key in ('cpu_ms', 'wall_ms', 'messages_per_cycle'):
+        s = summary[key]
+        print('  {:<20} mean {:9.2f}  p50 {:9.2f}  p95 {:9.2f}  max {:9.2f}'.format(
+            key, s['mean'], s['p50'], s['p95'], s['max']))
+    print('  messages            ' + ', '.join('{} {}'.format(k, v) for (k, v) in sorted(summary['messages'].items())))
+    if summary['api_calls'] is not None:
+        print('  api calls           {} ({} failed)'.format(summary['api_calls'], summary['api_failed']))
+    print('  peak rss            {:.1f} MB'.format(summary['peak_rss_kb'] / 1024))
+    if 'traced_peak_kb' in summary:
+        print('  traced peak         {:.1f} MB'.format(summary['traced_peak_kb'] / 1024))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the node server headless for a number of simulated hours')
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--servers', type=int, default=1, help='node servers to run in this process')
+    parser.add_argument('--short-poll', type=int, default=120, help='seconds')
+    parser.add_argument('--long-poll', type=int, default=600, help='seconds')
+    parser.add_argument('--param', action='append', default=[], help='custom parameter, NAME=VALUE (repeat for more)')
+    parser.add_argument('--api-url', help='use this API instead of starting the stand-in')
+    parser.add_argument('--scenario', choices=fake_api.SCENARIOS, default='ok', help='stand-in API scenario')
+    parser.add_argument('--latency', type=float, default=0, help='stand-in API latency in milliseconds')
+    parser.add_argument('--intervals', type=int, default=0, help='stand-in API intervals per timeline')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for a poll cycle')
+    parser.add_argument('--keep', type=int, default=0, help='messages to keep per node server (they are always counted)')
+    parser.add_argument('--workdir', help='directory for the cache files (default: a new temporary directory)')
+    parser.add_argument('--tracemalloc', action='store_true', help='also trace Python memory (slower)')
+    parser.add_argument('--json', help='write the summary and per cycle measurements to this file')
+    parser.add_argument('--log-level', default='WARNING')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=args.log_level, format='%(levelname)s %(threadName)s %(message)s')
+    result = run(args)
+    print_summary(result['summary'])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)